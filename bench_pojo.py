@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+
+# What constructing a Pojo costs per instance: the compiled __init__
+# against the loop that used to decide, for every field of every
+# instance, what kind of validator it had. And how many bytes a record
+# takes, with a __dict__ and as a CompactPojo. And loading a million rows
+# as read from a CSV file, one constructor call at a time, through
+# from_rows, and through from_columns, which only makes instances when
+# they are used. And moving records as bytes: to_bytes against pickle and
+# JSON, in size and in time to encode and decode. And N records with only
+# a thousand distinct values among them, plain and interned.
+
+import datetime
+import gc
+import json
+import logging
+import sys
+import timeit
+
+from pojo import Pojo, CompactPojo, InternedPojo
+
+try:
+    import cPickle as pickle
+except ImportError:     # Python 3
+    import pickle
+
+try:
+    import tracemalloc
+except ImportError:     # Python 2
+    tracemalloc = None
+
+logging.basicConfig(
+    format='%(asctime)-15s  %(levelname)s  %(filename)s:%(lineno)d  %(message)s',
+    level=logging.INFO,
+)
+
+N = 100000
+ROWS = 1000000
+
+
+class Interpreted(object):
+    """Pojo.__init__ as it was before __fields__ got compiled."""
+
+    def __init__(self, *args):
+        if len(args) != len(self.__fields__):
+            raise TypeError((args, self.__fields__))
+        for arg, (name, _type) in zip(args, self.__fields__):
+            if isinstance(_type, type):
+                if _type in (int, float, complex, str):
+                    try:
+                        arg = _type(arg)
+                    except Exception:
+                        pass
+                elif _type in (datetime.date,
+                               datetime.datetime,
+                               datetime.timedelta):
+                    raise NotImplementedError(_type)
+                if not isinstance(arg, _type):
+                    raise TypeError((name, arg, _type))
+            elif callable(_type):
+                if not _type(arg):
+                    raise TypeError((name, arg, _type))
+            else:
+                raise TypeError((name, arg, _type))
+            self.__dict__[name] = arg
+
+
+def _positive(x):
+    return x > 0
+
+
+class Point(Pojo):
+    __fields__ = [("x", int), ("y", float), ("label", str),
+                  ("weight", _positive)]
+
+
+class Line(Pojo):
+    __fields__ = [("start", Point), ("end", Point)]
+
+
+class CompactPoint(CompactPojo):
+    __fields__ = Point.__fields__
+
+
+class OldPoint(Interpreted):
+    __fields__ = Point.__fields__
+
+
+class OldLine(Interpreted):
+    __fields__ = [("start", OldPoint), ("end", OldPoint)]
+
+
+def per_instance(make):
+    return timeit.timeit(make, number=N) / N
+
+
+def construction():
+    p, q = Point(1, 2., "a", 3), OldPoint(1, 2., "a", 3)
+    cases = [
+        ('flat, exact types', lambda: OldPoint(1, 2., "a", 3),
+         lambda: Point(1, 2., "a", 3)),
+        ('flat, coerced', lambda: OldPoint("1", 2, "a", 3),
+         lambda: Point("1", 2, "a", 3)),
+        ('nested', lambda: OldLine(q, q), lambda: Line(p, p)),
+    ]
+    for name, old, new in cases:
+        before, after = per_instance(old), per_instance(new)
+        logging.info('construct %-18s  interpreted %6.2f usec  '
+                     'compiled %6.2f usec  %4.1fx',
+                     name, before * 1e6, after * 1e6, before / after)
+
+
+def record_bytes(obj):
+    """The record itself, without the field values all layouts share."""
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+
+def allocated_per_instance(make):
+    """Bytes allocated per instance over N of them, Python 3 only."""
+    gc.collect()
+    tracemalloc.start()
+    keep = [make() for _ in range(N)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return float(size - sys.getsizeof(keep)) / len(keep)
+
+
+def memory():
+    cases = [
+        ('Pojo', lambda: Point(1, 2., "a", 3)),
+        ('CompactPojo', lambda: CompactPoint(1, 2., "a", 3)),
+    ]
+    for name, make in cases:
+        line = 'memory    %-18s  %4d bytes/record' % (name,
+                                                      record_bytes(make()))
+        if tracemalloc is not None:
+            line += '  %6.1f bytes allocated/instance' % \
+                allocated_per_instance(make)
+        logging.info(line)
+
+
+class Row(Pojo):
+    __fields__ = [("id", int), ("price", float), ("name", str)]
+
+
+def timed(f):
+    start = timeit.default_timer()
+    f()
+    return timeit.default_timer() - start
+
+
+def bulk():
+    rows = [(str(i), "%d.5" % i, "item%d" % i) for i in range(ROWS)]
+    columns = dict(zip(("id", "price", "name"), zip(*rows)))
+    one_by_one = None
+    for name, f in (('one by one', lambda: [Row(*row) for row in rows]),
+                    ('from_rows', lambda: Row.from_rows(rows)),
+                    ('from_columns', lambda: Row.from_columns(columns))):
+        elapsed = timed(f)
+        one_by_one = one_by_one or elapsed
+        logging.info('load      %-18s  %6.2f sec for %d rows  %5.1fx',
+                     name, elapsed, ROWS, one_by_one / elapsed)
+
+
+class Order(Pojo):
+    __fields__ = [("id", int), ("price", float), ("name", str),
+                  ("row", Row)]
+
+
+def serialization():
+    orders = [Order(i, i + .5, "order%d" % i, Row(i, i * 2., "item%d" % i))
+              for i in range(N)]
+
+    def to_json(records):
+        return json.dumps([dict(vars(r), row=vars(r.row)) for r in records])
+
+    def from_json(data):
+        return [Order(d["id"], d["price"], d["name"],
+                      Row(d["row"]["id"], d["row"]["price"],
+                          d["row"]["name"]))
+                for d in json.loads(data)]
+    cases = [
+        ('pickle', lambda: pickle.dumps(orders, 2), pickle.loads),
+        ('json', lambda: to_json(orders), from_json),
+        ('to_bytes', lambda: Order.many_to_bytes(orders),
+         Order.many_from_bytes),
+    ]
+    for name, encode, decode in cases:
+        data = encode()
+        encode_time = timed(encode)
+        decode_time = timed(lambda: decode(data))
+        logging.info('serialize %-18s  %5.1f bytes/record  encode %5.2f usec'
+                     '  decode %5.2f usec', name, float(len(data)) / N,
+                     encode_time / N * 1e6, decode_time / N * 1e6)
+
+
+class InternedRow(InternedPojo, CompactPojo):
+    __fields__ = Row.__fields__
+
+
+def interning():
+    values = [(i % 1000, (i % 1000) + .5, "item%d" % (i % 1000))
+              for i in range(N)]
+    for name, cls in (('Pojo', Row), ('InternedPojo', InternedRow)):
+        build = timed(lambda: [cls(*v) for v in values]) / N
+        records = [cls(*v) for v in values]
+        distinct = len(set(map(id, records)))
+        # dedup by value, as a plain Pojo has to, by its fields
+        if cls is Row:
+            dedup = timed(lambda: set((r.id, r.price, r.name)
+                                      for r in records))
+        else:
+            dedup = timed(lambda: set(records))
+        records = None  # not del, the lambda above closes over it
+        line = 'intern    %-18s  construct %5.2f usec  %6d objects  ' \
+            'dedup %5.1f msec' % (name, build * 1e6, distinct, dedup * 1e3)
+        if tracemalloc is not None:
+            line += '  %6.1f bytes/record' % allocated_per_instance(
+                lambda v=iter(values * 2): cls(*next(v)))
+        logging.info(line)
+
+
+def main():
+    construction()
+    memory()
+    bulk()
+    serialization()
+    interning()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+# What a contracted method call costs on top of the plain call, with
+# every contract checked and with preconditions only: a public method
+# overriding a contracted base class method, a private method and a
+# public module function.
+
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+import contract
+
+logging.basicConfig(
+    format='%(asctime)-15s  %(levelname)s  %(filename)s:%(lineno)d  %(message)s',
+    level=logging.INFO,
+)
+
+CALLS = 20000
+REPEAT = 5
+
+MODULE = '''
+class Base:
+    """
+    inv:
+        self.balance >= 0
+    """
+    def __init__(self):
+        self.balance = 0
+
+    def deposit(self, amount):
+        """
+        pre:
+            amount > 0
+        post[self.balance]:
+            self.balance == __old__.self.balance + amount
+        """
+        self.balance += amount
+
+class Account(Base):
+    def deposit(self, amount):
+        """
+        pre:
+            isinstance(amount, int)
+        """
+        self.balance += amount
+        self._touch()
+
+    def _touch(self):
+        """
+        pre:
+            self.balance >= 0
+        """
+        pass
+
+def fee(amount):
+    """
+    pre:
+        amount >= 0
+    post:
+        __return__ <= amount
+    """
+    return amount // 100
+'''
+
+
+def load(directory, name, checklevel):
+    f = open(os.path.join(directory, name + '.py'), 'w')
+    f.write(MODULE)
+    f.close()
+    module = __import__(name)
+    if checklevel is not None:
+        contract.checkmod(module, checklevel)
+    return module
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    sys.path.insert(0, directory)
+    try:
+        plain = load(directory, 'calls_plain', None)
+        for label, level in (('all', contract.CHECK_ALL),
+                             ('preconditions', contract.CHECK_PRECONDITIONS)):
+            checked = load(directory, 'calls_' + label, level)
+            for what, call in (
+                    ('public method', lambda m: m.Account().deposit),
+                    ('module function', lambda m: m.fee)):
+                base = min(timeit.Timer(lambda f=call(plain): f(10))
+                           .repeat(REPEAT, CALLS))
+                cost = min(timeit.Timer(lambda f=call(checked): f(10))
+                           .repeat(REPEAT, CALLS))
+                logging.info('%-13s %-15s  %6.2f usec/call, plain %5.2f',
+                             label, what, cost / CALLS * 1e6,
+                             base / CALLS * 1e6)
+    finally:
+        sys.path.remove(directory)
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
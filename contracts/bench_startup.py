@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+# How long checkmod takes at process start for a module with hundreds
+# of contracted methods: cold, with nothing cached, and warm, with the
+# parsed contracts and compiled checkers cached from the previous run.
+# Each start is a fresh interpreter, as it would be in real life.
+
+import logging
+import os
+import py_compile
+import shutil
+import subprocess
+import sys
+import tempfile
+
+logging.basicConfig(
+    format='%(asctime)-15s  %(levelname)s  %(filename)s:%(lineno)d  %(message)s',
+    level=logging.INFO,
+)
+
+CLASSES = 100
+METHODS = 3
+RUNS = 5
+
+CLASS = '''
+class Account%(i)d:
+    """
+    inv:
+        self.balance >= 0
+        isinstance(self.history, list)
+    """
+    def __init__(self):
+        """
+        post:
+            self.balance == 0
+        """
+        self.balance = 0
+        self.history = []
+'''
+
+METHOD = '''
+    def deposit%(j)d(self, amount):
+        """
+        pre:
+            amount > 0
+            isinstance(amount, int)
+        post[self.balance, self.history]:
+            self.balance == __old__.self.balance + amount
+            len(self.history) == len(__old__.self.history) + 1
+        """
+        self.balance += amount
+        self.history.append(amount)
+'''
+
+TIMER = '''
+import sys, time
+sys.path[:0] = [%r, %r]
+start = time.time()
+import contract
+contract.checkmod('contracted')
+sys.stdout.write('%%f' %% (time.time() - start))
+'''
+
+
+def write_module(directory):
+    f = open(os.path.join(directory, 'contracted.py'), 'w')
+    for i in range(CLASSES):
+        f.write(CLASS % {'i': i})
+        for j in range(METHODS):
+            f.write(METHOD % {'j': j})
+    f.close()
+    # so that cold starts don't also pay for compiling the module itself
+    py_compile.compile(f.name)
+
+
+def start(directory, cache_dir):
+    env = dict(os.environ, CONTRACT_CACHE_DIR=cache_dir)
+    here = os.path.dirname(os.path.abspath(__file__))
+    out = subprocess.Popen([sys.executable, '-c', TIMER % (directory, here)],
+                           env=env, stdout=subprocess.PIPE).communicate()[0]
+    return float(out)
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    cache_dir = os.path.join(directory, 'cache')
+    try:
+        write_module(directory)
+        cold, warm = [], []
+        for _ in range(RUNS):
+            shutil.rmtree(cache_dir, True)
+            cold.append(start(directory, cache_dir))
+            warm.append(start(directory, cache_dir))
+        logging.info('%d contracted methods: cold start %.3f sec, '
+                     'warm start %.3f sec (best of %d)',
+                     CLASSES * (METHODS + 1), min(cold), min(warm), RUNS)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -145,13 +145,39 @@ SUPPORT, UPDATES, ENHANCEMENTS, OR MODIFICATIONS.
 #   All installed checker functions return True, so they can be used
 #   in contracts, ex: "pre: Base.method.__assert_pre(self, a, b)"
 #
+#   perf001 2026-10-18
+#   checkmod re-tokenized every docstring and recompiled every
+#   generated checker at each process start.  Parsed contracts and
+#   compiled checker code are now kept in a cache file per module,
+#   keyed by a hash of the module's source, so warm starts skip both.
+#   See _ContractCache.
+#
+#   perf002 2026-10-18
+#   Every checked method call walked the class's mro with getmro,
+#   built the list of overridden methods and probed each of them and
+#   each class with hasattr, only to find the same checkers as last
+#   time.  These are now resolved once per class and per checked
+#   function into tuples, kept until the next checkmod or
+#   reset_dispatch().  See _make_table.
+#
+#   perf003 2026-10-18
+#   The perf001 cache lived in a shared, world-writable temporary
+#   directory, under predictable names, and its code objects get
+#   executed: any local user could plant checkers in someone else's
+#   process.  It now lives in ~/.cache/contract, created private, and
+#   a directory or file that isn't the user's own, or that others can
+#   write to, is not used.
+#
 __author__ = "Terence Way"
 __email__ = "terry@wayforward.net"
 __version__ = "1.4: August 31, 2007"
 MODULE = 'contract'
 
+import marshal
 import new
+import os
 import re
+import stat
 import sys
 import tokenize
 
@@ -309,6 +335,127 @@ except NameError:
 # Part 1 -- Find docstrings and parse them for contract expressions...
 #
 
+# perf001 cache parsed contracts and compiled checkers...
+class _ContractCache:
+    """Parsed docstrings and compiled checker code for one module.
+
+    Stored with marshal in CACHE_DIR (or $CONTRACT_CACHE_DIR), in a file
+    named by a hash of the module's source, the Python version, this
+    module's version and the check level, so any change to them simply
+    misses.  A file that can't be read or written is ignored, and so
+    is one that could have been written by another user (perf003).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.parsed, self.code = {}, {}
+        self.dirty = False
+        if path is not None:
+            try:
+                # perf003 only load what we wrote ourselves...
+                fd = os.open(path, os.O_RDONLY | _O_NOFOLLOW)
+                f = os.fdopen(fd, 'rb')
+                try:
+                    if _trusted(os.fstat(fd)):
+                        self.parsed, self.code = marshal.load(f)
+                finally:
+                    f.close()
+                # ...perf003
+            except (IOError, OSError, EOFError, ValueError, TypeError):
+                pass
+
+    def parse(self, docstring, keywords):
+        if docstring is None:
+            return parse_docstring(docstring, keywords)
+        key = (docstring, tuple(keywords))
+        result = self.parsed.get(key)
+        if result is None:
+            result = self.parsed[key] = parse_docstring(docstring, keywords)
+            self.dirty = True
+        return result
+
+    def compile(self, text):
+        code = self.code.get(text)
+        if code is None:
+            code = self.code[text] = compile(text, '<string>', 'exec')
+            self.dirty = True
+        return code
+
+    def save(self):
+        if self.path is None or not self.dirty:
+            return
+        tmp = '%s.%d' % (self.path, os.getpid())
+        try:
+            # perf003 a new file, readable by us only...
+            if os.path.lexists(tmp):
+                os.unlink(tmp)  # left by a crash
+            f = os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL |
+                                  _O_NOFOLLOW, 0600), 'wb')
+            # ...perf003
+            try:
+                marshal.dump((self.parsed, self.code), f)
+            finally:
+                f.close()
+            os.rename(tmp, self.path)   # atomic, for concurrent starts
+        except (IOError, OSError):
+            pass
+
+# perf003 a private directory, not a shared temporary one...
+CACHE_DIR = os.environ.get('CONTRACT_CACHE_DIR') or \
+    os.path.join(os.environ.get('XDG_CACHE_HOME') or
+                 os.path.join(os.path.expanduser('~'), '.cache'), 'contract')
+
+_O_NOFOLLOW = getattr(os, 'O_NOFOLLOW', 0)
+
+def _trusted(st):
+    """Test if a file or directory is ours, and only we can write to it.
+    """
+    return st.st_uid == os.getuid() and not st.st_mode & 022
+
+def _cache_dir():
+    """CACHE_DIR, created private if need be, or None if it can't be
+    trusted.
+    """
+    if not os.path.isabs(CACHE_DIR):
+        return None     # no home directory
+    try:
+        if not os.path.isdir(CACHE_DIR):
+            os.makedirs(CACHE_DIR, 0700)
+        st = os.lstat(CACHE_DIR)
+    except OSError:
+        return None
+    if not stat.S_ISDIR(st.st_mode) or not _trusted(st):
+        return None
+    return CACHE_DIR
+# ...perf003
+
+# the cache of the module checkmod is working on, if any
+_cache = _ContractCache(None)
+
+def _cache_path(module, checklevel):
+    """Where the cache for module lives, or None if it has no source."""
+    filename = getattr(module, '__file__', None)
+    directory = _cache_dir()
+    if filename is None or directory is None:
+        return None
+    if filename[-4:] in ('.pyc', '.pyo'):
+        filename = filename[:-1]
+    try:
+        f = open(filename, 'rb')
+        try:
+            source = f.read()
+        finally:
+            f.close()
+    except IOError:
+        return None
+    import hashlib
+    h = hashlib.sha1(source)
+    h.update('\0%s\0%s\0%d' % (sys.version, __version__, checklevel))
+    return os.path.join(directory, h.hexdigest())
+
+def _parse(docstring, keywords):
+    return _cache.parse(docstring, keywords)
+# ...perf001
+
 def checkmod(module, checklevel = CHECK_DEFAULT):
     """Add invariant, pre- and post-condition checking to a module.
 
@@ -334,22 +481,37 @@ def checkmod(module, checklevel = CHECK_DEFAULT):
     # ...ttw008
 
     if checklevel != CHECK_NONE:
-        # get members *before* we start adding stuff to this module
-        path = [module]
-        members = _get_members(module, path)
-        invs = parse_docstring(module.__doc__, TYPE_CONTRACTS)[0]
-        name = PREFIX + INV
-        func = getattr(module, name, None)
-        # should we override
-        if not func or func.__name__.startswith(PREFIX):
-            if invs[2]:
-                func = _define_checker(name, '', invs, path)
-            else:
-                func = __assert_inv
-                module.__assert_inv = func
-        _check_members(members, path, checklevel)
-        # check module invariants now
-        func()
+        # perf001 cache parsed contracts and compiled checkers...
+        global _cache
+        outer = _cache
+        _cache = _ContractCache(_cache_path(module, checklevel))
+        try:
+            _checkmod(module, checklevel)
+        finally:
+            _cache.save()
+            _cache = outer
+        # ...perf001
+        # perf002 classes changed, dispatch tables are stale...
+        reset_dispatch()
+        # ...perf002
+
+def _checkmod(module, checklevel):
+    # get members *before* we start adding stuff to this module
+    path = [module]
+    members = _get_members(module, path)
+    invs = _parse(module.__doc__, TYPE_CONTRACTS)[0]
+    name = PREFIX + INV
+    func = getattr(module, name, None)
+    # should we override
+    if not func or func.__name__.startswith(PREFIX):
+        if invs[2]:
+            func = _define_checker(name, '', invs, path)
+        else:
+            func = __assert_inv
+            module.__assert_inv = func
+    _check_members(members, path, checklevel)
+    # check module invariants now
+    func()
 
 def _check_type(code, path, checklevel):
     """Modify a class to add invariant checking.
@@ -366,7 +528,7 @@ def _check_type(code, path, checklevel):
     # get members *before* we start adding stuff to this class
     path = path + [obj]
     members = _get_members(obj, path)
-    invs = parse_docstring(obj.__doc__, TYPE_CONTRACTS)[0]
+    invs = _parse(obj.__doc__, TYPE_CONTRACTS)[0]
     if invs[2]:
         func = _define_checker(_mkname(path, INV), 'self', invs, path)
         setattr(obj, PREFIX + INV, func)
@@ -377,7 +539,7 @@ def _check_proc(code, path, checklevel):
     """Modify a module or class to add invariant checking.
     """
     name, obj = code
-    _install_wrapper(code, parse_docstring(obj.__doc__, CODE_CONTRACTS), path,
+    _install_wrapper(code, _parse(obj.__doc__, CODE_CONTRACTS), path,
                      is_public = _ispublic(name), checklevel = checklevel)
 
 def _get_location(f):
@@ -879,7 +1041,7 @@ def _define_saver(name, args, decls, module):
 
 def _define(name, text, module):
     #print text
-    exec text in vars(module)
+    exec _cache.compile(text) in vars(module)
     return getattr(module, name)
 
 def _format_args( (arguments, rest, keywords, default_values) ):
@@ -1132,7 +1294,7 @@ def call_public_function_all(inv, func, *va, **ka):
     inv()
     try:
         # ttw015: avoid making a list of functions...
-        return _call_one_all(func, va, ka)
+        return _call_all(_function_table(func), va, ka)
         # ...ttw015
     finally:
         inv()
@@ -1144,7 +1306,7 @@ def call_public_function_pre(inv, func, *va, **ka):
     """
     inv()
     # ttw015: avoid making a list of functions...
-    return _call_one_pre(func, va, ka)
+    return _call_pre(_function_table(func), va, ka)
     # ...ttw015
 
 def call_private_function_all(func, *va, **ka):
@@ -1153,7 +1315,7 @@ def call_private_function_all(func, *va, **ka):
     Only checks pre-conditions and post-conditions.
     """
     # ttw015: avoid making a list of functions...
-    return _call_one_all(func, va, ka)
+    return _call_all(_function_table(func), va, ka)
     # ...ttw015
 
 def call_private_function_pre(func, *va, **ka):
@@ -1162,7 +1324,7 @@ def call_private_function_pre(func, *va, **ka):
     Only checks pre-conditions
     """
     # ttw015: avoid making a list of functions...
-    return _call_one_pre(func, va, ka)
+    return _call_pre(_function_table(func), va, ka)
     # ...ttw015
 
 def call_public_method_all(cls, method, *va, **ka):
@@ -1172,12 +1334,14 @@ def call_public_method_all(cls, method, *va, **ka):
     exit.  Checks all post-conditions of this method and all over-
     ridden method.
     """
-    mro = getmro(cls)
-    _check_class_invariants(mro, va[0])
+    invs = _class_invariants(cls)
+    for inv in invs:
+        inv(va[0])
     try:
-        return _method_call_all(mro, method, va, ka)
+        return _call_all(_method_table(cls, method), va, ka)
     finally:
-        _check_class_invariants(mro, va[0])
+        for inv in invs:
+            inv(va[0])
 
 def call_public_method_pre(cls, method, *va, **ka):
     """Check the invocation of a public method.
@@ -1185,9 +1349,9 @@ def call_public_method_pre(cls, method, *va, **ka):
     Check this class and all super-classes invariants on entry.
     exit.
     """
-    mro = getmro(cls)
-    _check_class_invariants(mro, va[0])
-    return _method_call_pre(mro, method, va, ka)
+    for inv in _class_invariants(cls):
+        inv(va[0])
+    return _call_pre(_method_table(cls, method), va, ka)
 
 def call_constructor_all(cls, method, *va, **ka):
     """Check the invocation of an __init__ constructor.
@@ -1201,8 +1365,9 @@ def call_constructor_all(cls, method, *va, **ka):
     # mro = getmro(cls)
     # result = _method_call_all(mro, method, va, ka)
     # _check_class_invariants(mro, va[0])
-    result = _method_call_all([cls], method, va, ka)
-    _check_class_invariants(getmro(cls), va[0])
+    result = _call_all(_constructor_table(cls, method), va, ka)
+    for inv in _class_invariants(cls):
+        inv(va[0])
     # ...ab001
 
     return result
@@ -1220,8 +1385,9 @@ def call_constructor_pre(cls, method, *va, **ka):
     # mro = getmro(cls)
     # result = _method_call_pre(mro, method, va, ka)
     # _check_class_invariants(mro, va[0])
-    result = _method_call_pre([cls], method, va, ka)
-    _check_class_invariants(getmro(cls), va[0])
+    result = _call_pre(_constructor_table(cls, method), va, ka)
+    for inv in _class_invariants(cls):
+        inv(va[0])
     # ...ab001
 
     return result
@@ -1233,9 +1399,9 @@ def call_destructor_all(cls, method, *va, **ka):
     Checks pre-conditions and post-conditions, and only checks
     invariants on entry.
     """
-    mro = getmro(cls)
-    _check_class_invariants(mro, va[0])
-    return _method_call_all(mro, method, va, ka)
+    for inv in _class_invariants(cls):
+        inv(va[0])
+    return _call_all(_method_table(cls, method), va, ka)
 
 def call_destructor_pre(cls, method, *va, **ka):
     """Check the invocation of a __del__ destructor.
@@ -1243,135 +1409,154 @@ def call_destructor_pre(cls, method, *va, **ka):
     Checks pre-conditions and post-conditions, and only checks
     invariants on entry.
     """
-    mro = getmro(cls)
-    _check_class_invariants(mro, va[0])
-    return _method_call_pre(mro, method, va, ka)
+    for inv in _class_invariants(cls):
+        inv(va[0])
+    return _call_pre(_method_table(cls, method), va, ka)
 
 def call_private_method_all(cls, method, *va, **ka):
     """Check the invocation of a private method call.
 
     Checks pre-conditions and post-conditions.
     """
-    return _method_call_all(getmro(cls), method, va, ka)
+    return _call_all(_method_table(cls, method), va, ka)
 
 def call_private_method_pre(cls, method, *va, **ka):
     """Check the invocation of a private method call.
 
     Checks pre-conditions.
     """
-    return _method_call_pre(getmro(cls), method, va, ka)
+    return _call_pre(_method_table(cls, method), va, ka)
 
-def _check_class_invariants(mro, instance):
-    """Checks class invariants on an instance.
+# perf002 per-class dispatch tables...
+# Every checked call used to walk the class's mro, build the list of
+# overridden methods and probe each one with hasattr for checkers.
+# All of that only changes when classes do, so it is worked out once
+# per class and per wrapper, and kept here until the next checkmod or
+# reset_dispatch().
 
-    mro - list of classes in method-resolution order
-    instance - object to test
+_invariants = {}    # class -> tuple of __assert_inv, in mro order
+_tables = {}        # checker function -> _make_table tuple
 
-    pre::
-        # instance must be an instance of each class in mro
-        forall(mro, lambda x: isinstance(instance, x))
-    """
-    # ab002: Avoid generating AttributeError exceptions...
-    for c in mro:
-        if hasattr(c, '__assert_inv'):
-            c.__assert_inv(instance)
-    # ...ab002
+def reset_dispatch():
+    """Forget the dispatch tables of all checked classes and functions.
 
-def _method_call_all(mro, method, va, ka):
-    """Check the invocation of a method.
+    checkmod does this itself.  Call it after changing contracted
+    classes by hand, ex: replacing a method or a base class, so that
+    the next call sees the change.
+    """
+    _invariants.clear()
+    _tables.clear()
 
-    mro -- list/tuple of class objects in method resolution order
+def _class_invariants(cls):
+    """Returns the invariant checkers of a class and its super-classes.
     """
-    # NO CONTRACTS... recursion
-    assert isinstance(method, MethodType)
+    try:
+        return _invariants[cls]
+    except KeyError:
+        invs = []
+        seen = []
+        for c in getmro(cls):
+            # ab002: Avoid generating AttributeError exceptions...
+            if hasattr(c, '__assert_inv'):
+                inv = getattr(c, '__assert_inv')
+                # a sub-class without an inv: inherits its base's, which
+                # need not be checked twice
+                func = getattr(inv, 'im_func', inv)
+                if func not in seen:
+                    seen.append(func)
+                    invs.append(inv)
+            # ...ab002
+        _invariants[cls] = invs = tuple(invs)
+        return invs
+
+def _method_table(cls, method):
+    func = method.im_func
+    try:
+        return _tables[func]
+    except KeyError:
+        # NO CONTRACTS... recursion
+        assert isinstance(method, MethodType)
+        return _make_table(func, getmro(cls))
 
+def _constructor_table(cls, method):
     func = method.im_func
-    name = func.__assert_orig.__name__
-    # list of all method functions with name
-    a = [getattr(c, name).im_func for c in mro if _has_method(c, name)]
+    try:
+        return _tables[func]
+    except KeyError:
+        # ab001: only this class's constructor preconditions
+        return _make_table(func, [cls])
 
-    return _call_all(a, func, va, ka)
+def _function_table(func):
+    try:
+        return _tables[func]
+    except KeyError:
+        return _make_table(func, None)
 
-def _method_call_pre(mro, method, va, ka):
-    """Check the invocation of a method.
+def _make_table(func, mro):
+    """Resolves the checkers run on a call to a checked function.
 
-    mro -- list/tuple of class objects in method resolution order
+    func -- the installed checker function
+    mro -- classes to look for overridden methods in, or None
     """
-    # NO CONTRACTS... recursion
-    func = method.im_func
-    name = func.__assert_orig.__name__
-    # list of all method functions with name
-    a = [getattr(c, name).im_func for c in mro if _has_method(c, name)]
-
-    return _call_pre(a, func, va, ka)
+    if mro is None:
+        a = [func]
+    else:
+        name = func.__assert_orig.__name__
+        # list of all method functions with name
+        a = [getattr(c, name).im_func for c in mro if _has_method(c, name)]
+    # ab002: Avoid generating AttributeError exceptions...
+    # (pre, super-class pres, savers, original function, posts)
+    table = (getattr(func, '__assert_pre', None),
+             tuple([f.__assert_pre for f in a
+                    if f is not func and hasattr(f, '__assert_pre')]),
+             tuple([f.__assert_save for f in a
+                    if hasattr(f, '__assert_save')]),
+             func.__assert_orig,
+             tuple([f.__assert_post for f in a
+                    if hasattr(f, '__assert_post')]))
+    # ...ab002
+    _tables[func] = table
+    return table
 
-def _call_one_all(func, va, ka):
-    if hasattr(func, '__assert_pre'):
-        func.__assert_pre(*va, **ka)
+def _call_all((pre, super_pres, savers, orig, posts), va, ka):
+    if pre is not None:
+        _check_preconditions(pre, super_pres, va, ka)
 
     # save old values
     old = _holder()
 
-    if hasattr(func, '__assert_save'):
-        func.__assert_save(old, *va, **ka)
+    for f in savers:
+        f(old, *va, **ka)
 
-    result = func.__assert_orig(*va, **ka)
+    result = orig(*va, **ka)
     # check post-conditions
-    if hasattr(func, '__assert_post'):
-        func.__assert_post(old, result, *va, **ka)
-
-    return result
-
-def _call_one_pre(func, va, ka):
-    if hasattr(func, '__assert_pre'):
-        func.__assert_pre(*va, **ka)
-
-    return func.__assert_orig(*va, **ka)
-
-def _call_all(a, func, va, ka):
-    _check_preconditions(a, func, va, ka)
-
-    # save old values
-    old = _holder()
-
-    # ab002: Avoid generating AttributeError exceptions...
-    for f in a:
-        if hasattr(f, '__assert_save'):
-            f.__assert_save(old, *va, **ka)
-
-    result = func.__assert_orig(*va, **ka)
-    for f in a:
-        # check post-conditions
-        if hasattr(f, '__assert_post'):
-            f.__assert_post(old, result, *va, **ka)
-    # ...ab002
+    for f in posts:
+        f(old, result, *va, **ka)
 
     return result
 
-def _call_pre(a, func, va, ka):
-    _check_preconditions(a, func, va, ka)
-    return func.__assert_orig(*va, **ka)
+def _call_pre((pre, super_pres, savers, orig, posts), va, ka):
+    if pre is not None:
+        _check_preconditions(pre, super_pres, va, ka)
+    return orig(*va, **ka)
 
-def _check_preconditions(a, func, va, ka):
+def _check_preconditions(pre, super_pres, va, ka):
     # ttw006: correctly weaken pre-conditions...
-    # ab002: Avoid generating AttributeError exceptions...
-    if hasattr(func, '__assert_pre'):
-        try:
-            func.__assert_pre(*va, **ka)
-        except PreconditionViolationError, args:
-            # if the pre-conditions fail, *all* super-preconditions
-            # must fail too, otherwise
-            for f in a:
-                if f is not func and hasattr(f, '__assert_pre'):
-                    f.__assert_pre(*va, **ka)
-                    raise InvalidPreconditionError(args)
-            # rr001: raise original PreconditionViolationError, not
-            # inner AttributeError...
-            # raise
-            raise args
-            # ...rr001
-    # ...ab002
+    try:
+        pre(*va, **ka)
+    except PreconditionViolationError, args:
+        # if the pre-conditions fail, *all* super-preconditions
+        # must fail too, otherwise
+        for f in super_pres:
+            f(*va, **ka)
+            raise InvalidPreconditionError(args)
+        # rr001: raise original PreconditionViolationError, not
+        # inner AttributeError...
+        # raise
+        raise args
+        # ...rr001
     # ...ttw006
+# ...perf002
 
 def _has_method(cls, name):
     """Test if a class has a named method.
@@ -1,4 +1,7 @@
+import itertools
 import linecache
+import os
+import socket
 import sys
 import time
 import trace
@@ -58,8 +61,24 @@ def trace_to_log(level):
     return decorator
 
 
+_dumps = itertools.count()
+
+
+def _dump_path(directory):
+    """A file name in directory that no other process or host will pick."""
+    return os.path.join(directory, '%s-%d-%d.prof' % (
+        socket.gethostname(), os.getpid(), next(_dumps)))
+
+
 @contextmanager
-def profile_to_log(log_level):
+def profile_to_log(log_level, dump=None):
+    """
+    Profile the with block and log the stats at log_level.
+
+    @param dump: directory to also save the stats in, in the binary pstats
+        format, so that ugly-perf-hack/collect_profiles.py can merge them
+        across processes and hosts
+    """
     class StreamToLogger(object):
         def __init__(self, logger):
             self.logger = logger
@@ -89,6 +108,10 @@ def profile_to_log(log_level):
             orig_ss, sys.stdout = sys.stdout, StreamToLogger(logger)
             pr.print_stats(sort='tottime')
             sys.stdout = orig_ss
+            if dump is not None:
+                if not os.path.isdir(dump):
+                    os.makedirs(dump)
+                pr.dump_stats(_dump_path(dump))
 
 
 if __name__ == '__main__':
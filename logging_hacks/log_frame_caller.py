@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 
-import inspect
 import os
+import sys
 import logging
 import traceback
 from contextlib import contextmanager
@@ -15,35 +15,51 @@ logging.basicConfig(
 
 
 def __LINE__():
-    callerframerecord = inspect.stack()[1]
-    frame = callerframerecord[0]
-    info = inspect.getframeinfo(frame)
-    return info.lineno
+    return sys._getframe(1).f_lineno
 
 
+_PY2 = sys.version_info[0] == 2
 _frame_delta = 0
+_in_logging = {}    # code object -> whether it is the logging module's own
+
+
+# _outside_logging and findCaller have a twin in ugly-perf-hack/perf.py,
+# which keeps the delta in logging._frame_delta; change both together
+def _outside_logging(f):
+    while f is not None:
+        co = f.f_code
+        inside = _in_logging.get(co)
+        if inside is None:
+            inside = _in_logging[co] = \
+                os.path.normcase(co.co_filename) == logging._srcfile
+        if not inside:
+            break
+        f = f.f_back
+    return f
 
 
-@contextmanager
-def logdelta(n):
-    global _frame_delta
-
-    def findCaller(_):
-        f = logging.currentframe()
-        for _ in range(2 + _frame_delta):
-            if f is not None:
-                f = f.f_back
+def findCaller(_, stack_info=False, stacklevel=1):
+    f = _outside_logging(sys._getframe(2))     # above Logger._log
+    skip = _frame_delta + stacklevel - 1
+    while skip and f is not None:
+        f = f.f_back
+        skip -= 1
+    if f is None:
         rv = "(unknown file)", 0, "(unknown function)"
-        while hasattr(f, "f_code"):
-            co = f.f_code
-            filename = os.path.normcase(co.co_filename)
-            if filename == logging._srcfile:
-                f = f.f_back
-                continue
-            rv = (co.co_filename, f.f_lineno, co.co_name)
-            break
+    else:
+        rv = (f.f_code.co_filename, f.f_lineno, f.f_code.co_name)
+    if _PY2:
         return rv
+    sinfo = None
+    if stack_info and f is not None:
+        sinfo = 'Stack (most recent call last):\n' + \
+            ''.join(traceback.format_stack(f)).rstrip('\n')
+    return rv + (sinfo,)
+
 
+@contextmanager
+def logdelta(n):
+    global _frame_delta
     fc = None
     d = _frame_delta
     try:
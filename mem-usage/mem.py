@@ -9,14 +9,46 @@
 import gc
 import os
 import sys
+import json
+import time
 import pprint
+import random
+import struct
 import resource
-import Queue
+import threading
 from collections import namedtuple
-from types import InstanceType
+from types import ModuleType, FunctionType, FrameType
+
+try:
+    from types import InstanceType
+    _LEAF_TYPES = frozenset([int, long, float, complex, bool, str, unicode,
+                             type(None)])
+except ImportError:     # Python 3, no old-style classes
+    class InstanceType(object):
+        pass
+    _LEAF_TYPES = frozenset([int, float, complex, bool, str, bytes,
+                             type(None)])
+
+try:
+    import tracemalloc
+except ImportError:     # Python 2
+    tracemalloc = None
 
 CycleFound = Exception
 Memory = namedtuple('Memory', ['pid', 'used'])
+TypeCount = namedtuple('TypeCount', ['count', 'size'])
+TypeGrowth = namedtuple('TypeGrowth', ['typename', 'count', 'size'])
+DeepSize = namedtuple('DeepSize', ['count', 'size', 'truncated'])
+Retained = namedtuple('Retained', ['name', 'count', 'deep', 'retained'])
+Chain = namedtuple('Chain', ['root', 'path'])
+Site = namedtuple('Site', ['where', 'count', 'size'])
+Sample = namedtuple('Sample', ['time', 'rss', 'pss', 'gc0', 'gc1', 'gc2',
+                               'types'])
+
+# Shared infrastructure rather than anybody's data, so deep sizes neither
+# count these nor look inside them.
+_STOP_TYPES = (type, ModuleType, FunctionType)
+_BATCH = 4096
 
 
 def _get_obj_type(obj):
@@ -31,7 +63,10 @@ def _short_typename(obj):
 
 
 def _long_typename(obj):
-    objtype = _get_obj_type(obj)
+    return _typename_of_type(_get_obj_type(obj))
+
+
+def _typename_of_type(objtype):
     name = objtype.__name__
     module = getattr(objtype, '__module__', None)
     if module:
@@ -58,35 +93,503 @@ def info(typename, objects, exclude=None):
 
 
 def all_info(objects):
-    s = set()
-    for o in objects:
-        s.add(_long_typename(o))
     n = sz = 0
-    for typename in s:
-        _n, _sz = info(typename, objects)
-        n += _n
-        sz += _sz
-    return (n, sz)
+    for count, size in census(objects).values():
+        n += count
+        sz += size
+    return (n, sz / (1024. * 1024.))
+
+
+def census(objects=None, sample=1):
+    """
+    Count objects and their shallow sizes per type, in one pass.
+    Objects are grouped by type first, and each type is named only once.
+    @param objects: defaults to gc.get_objects()
+    @param sample: look at one object in this many, and scale up
+    @return: dict of long typename -> TypeCount(count, size in bytes)
+    """
+    if objects is None:
+        # the list holds this very frame, drop it or it's a cycle
+        objects = gc.get_objects()
+        try:
+            return census(objects, sample)
+        finally:
+            del objects
+    if sample > 1:
+        objects = objects[random.randrange(sample)::sample]
+    by_type = {}
+    getsizeof = sys.getsizeof
+    for o in objects:
+        t = type(o)
+        if t is InstanceType:
+            t = o.__class__
+        entry = by_type.get(t)
+        if entry is None:
+            entry = by_type[t] = [0, 0]
+        entry[0] += 1
+        entry[1] += getsizeof(o)
+    result = {}
+    for t, (count, size) in by_type.items():
+        name = _typename_of_type(t)
+        # distinct types can share a name, classes defined in a loop say
+        if name in result:
+            count += result[name].count
+            size += result[name].size
+        result[name] = TypeCount(count, size)
+    if sample > 1:
+        result = dict((name, TypeCount(c * sample, s * sample))
+                      for name, (c, s) in result.items())
+    return result
+
+
+def diff_census(before, after, top=None):
+    """
+    Growth per type between two censuses, biggest growth in bytes first.
+    @return: list of TypeGrowth(typename, count, size)
+    """
+    zero = TypeCount(0, 0)
+    growth = []
+    for name in set(before) | set(after):
+        b = before.get(name, zero)
+        a = after.get(name, zero)
+        if a != b:
+            growth.append(TypeGrowth(name, a.count - b.count, a.size - b.size))
+    growth.sort(key=lambda g: (-g.size, -g.count, g.typename))
+    return growth[:top] if top is not None else growth
+
+
+class _LimitReached(Exception):
+    pass
+
+
+def _reachable(root, stop, limit):
+    """
+    Yield each object reachable from root once, breadth first. Referents
+    are fetched from gc a batch of objects at a time, which is much cheaper
+    than one call per object. Only ids are remembered, so nothing is kept
+    alive, and a limit on the number of objects bounds the memory used for
+    them.
+    """
+    if isinstance(root, stop):
+        return
+    seen = set([id(root)])
+    seen_add = seen.add
+    get_referents = gc.get_referents
+    leaf = _LEAF_TYPES
+    frontier = [root]
+    while frontier:
+        following = []
+        push = following.append
+        for start in range(0, len(frontier), _BATCH):
+            batch = frontier[start:start + _BATCH]
+            for o in batch:
+                yield o
+            if limit is not None and len(seen) >= limit:
+                raise _LimitReached()
+            for r in get_referents(*[o for o in batch
+                                     if type(o) not in leaf]):
+                rid = id(r)
+                if rid not in seen:
+                    seen_add(rid)
+                    if not isinstance(r, stop):
+                        push(r)
+        frontier = following
+
+
+def deep_size(obj, stop=_STOP_TYPES, limit=None):
+    """
+    Total shallow size of everything reachable from obj, each object counted
+    once however many references it has. Classes, modules and functions are
+    not counted or followed, see _STOP_TYPES.
+    @param limit: give up after this many objects, and say so
+    @return: DeepSize(count, size in bytes, truncated)
+    """
+    count = size = 0
+    getsizeof = sys.getsizeof
+    try:
+        for o in _reachable(obj, stop, limit):
+            count += 1
+            size += getsizeof(o)
+    except _LimitReached:
+        return DeepSize(count, size, True)
+    return DeepSize(count, size, False)
+
+
+def retained_sizes(roots, top=None, stop=_STOP_TYPES, limit=None):
+    """
+    Deep size of each root, and how much of that only it reaches: what
+    deleting it would free, as far as the other roots are concerned.
+    Objects reachable from other places than the roots aren't noticed.
+    @param roots: dict of name -> object, or a list of objects
+    @return: list of Retained(name, count, deep, retained) with the
+    biggest retained size first
+    """
+    if not isinstance(roots, dict):
+        roots = dict((_short_repr(r), r) for r in roots)
+    getsizeof = sys.getsizeof
+    owner = {}     # id -> (name of first root to reach it, size), or None
+    deep = {}
+    retained = {}
+    for name, root in roots.items():
+        count = size = 0
+        try:
+            for o in _reachable(root, stop, limit):
+                oid = id(o)
+                sz = getsizeof(o)
+                count += 1
+                size += sz
+                if oid not in owner:
+                    owner[oid] = (name, sz)
+                    retained[name] = retained.get(name, 0) + sz
+                elif owner[oid] is not None:
+                    first, sz = owner[oid]
+                    retained[first] -= sz
+                    owner[oid] = None
+        except _LimitReached:
+            pass
+        deep[name] = (count, size)
+    result = [Retained(name, deep[name][0], deep[name][1],
+                       retained.get(name, 0))
+              for name in roots]
+    result.sort(key=lambda r: (-r.retained, -r.deep, r.name))
+    return result[:top] if top is not None else result
+
+
+def _short_repr(obj, width=60):
+    r = repr(obj)
+    return r if len(r) <= width else r[:width - 3] + '...'
+
+
+def cycles(obj, stop=_STOP_TYPES):
+    """
+    Every reference cycle reachable from obj, found as the strongly connected
+    components of the referents graph with an iterative Tarjan's algorithm,
+    so it takes time linear in that graph and no recursion. Objects reached
+    by several paths without a loop back aren't a cycle. Strings and other
+    leaf objects can't be part of one, classes, modules and functions are
+    not followed, see _STOP_TYPES.
+    @return: list of cycles, each a list of the objects in it
+    """
+    def children(o):
+        if type(o) in _LEAF_TYPES:
+            return iter(())
+        return (r for r in gc.get_referents(o)
+                if type(r) not in _LEAF_TYPES and not isinstance(r, stop))
+
+    if isinstance(obj, stop) or type(obj) in _LEAF_TYPES:
+        return []
+    index = {}       # id -> order of discovery
+    low = {}         # id -> lowest index reachable while on the stack
+    on_stack = set()
+    stack = []
+    found = []
+    work = [(obj, children(obj))]
+    index[id(obj)] = low[id(obj)] = 0
+    stack.append(obj)
+    on_stack.add(id(obj))
+    while work:
+        v, it = work[-1]
+        vid = id(v)
+        for w in it:
+            wid = id(w)
+            if wid not in index:
+                index[wid] = low[wid] = len(index)
+                stack.append(w)
+                on_stack.add(wid)
+                work.append((w, children(w)))
+                break
+            elif wid in on_stack:
+                low[vid] = min(low[vid], index[wid])
+        else:
+            work.pop()
+            if work:
+                uid = id(work[-1][0])
+                low[uid] = min(low[uid], low[vid])
+            if low[vid] == index[vid]:
+                component = []
+                while True:
+                    w = stack.pop()
+                    on_stack.discard(id(w))
+                    component.append(w)
+                    if w is v:
+                        break
+                if len(component) > 1 or \
+                        any(r is v for r in gc.get_referents(v)):
+                    found.append(component)
+    return found
 
 
 def find_cycles(obj):
-    seen = set()
-    to_process = Queue.Queue()
-    to_process.put(obj)
-    while not to_process.empty():
-        next_guy = to_process.get()
-        seen.add(id(next_guy))
-        for r in gc.get_referents(next_guy):
-            if isinstance(r, basestring) or isinstance(r, type):
-                # Ignore strings and classes
-                pass
-            elif id(r) in seen:
-                raise CycleFound(pprint.pformat(r))
-            else:
-                to_process.put(r)
+    """Raise CycleFound, showing one member, if obj reaches any cycle."""
+    for component in cycles(obj):
+        raise CycleFound(pprint.pformat(component[0]))
+
+
+def keepers(obj, max_depth=50, ignore=()):
+    """
+    The shortest chain of references that keeps obj alive, from a module's
+    globals or from a running frame down to obj. Searches breadth first
+    over gc.get_referrers, asking about a whole level of objects in one
+    call, since each call has to scan the whole heap. The caller's frame
+    is not a root, it has obj in hand to ask about it.
+    @param ignore: more frames not to count as roots
+    @return: Chain(root, path) where root describes where the chain starts
+    and path is the list of objects from there to obj, or None
+    """
+    modules = dict((id(m.__dict__), name)
+                   for name, m in list(sys.modules.items()) if m is not None)
+    me = sys._getframe()
+    skipped = set(id(f) for f in ignore)
+    skipped.add(id(me.f_back))
+    # Since Python 3.11 a running frame's locals aren't visible to gc, so
+    # look at what each frame's locals refer to directly instead.
+    in_frames = {}
+    for frame in sys._current_frames().values():
+        while frame is not None:
+            if frame is not me and id(frame) not in skipped:
+                for v in frame.f_locals.values():
+                    in_frames.setdefault(id(v), frame)
+            frame = frame.f_back
+    parent = {id(obj): None}    # id -> referrer one step closer to a root
+    frontier = [obj]
+    ignored = set([id(parent), id(me), id(in_frames), id(skipped)])
+
+    def chain(root, o):
+        path = [o]
+        while parent[id(path[-1])] is not None:
+            path.append(parent[id(path[-1])])
+        return Chain(root, path)
+
+    def describe(frame):
+        return 'frame %s:%d %s' % (frame.f_code.co_filename, frame.f_lineno,
+                                   frame.f_code.co_name)
+
+    for _ in range(max_depth):
+        for o in frontier:
+            if id(o) in in_frames:
+                return chain(describe(in_frames[id(o)]), o)
+        ignored.add(id(frontier))
+        wanted = set(id(o) for o in frontier)
+        following = []
+        ignored.add(id(following))
+        for r in gc.get_referrers(*frontier):
+            rid = id(r)
+            if rid in ignored or rid in parent:
+                continue
+            # which of the frontier does r refer to?
+            child = None
+            for x in gc.get_referents(r):
+                if id(x) in wanted:
+                    child = x
+                    break
+            if child is None:
+                continue
+            if rid in modules:
+                return chain('module %s' % modules[rid], child)
+            if isinstance(r, FrameType):
+                if r.f_code is me.f_code or rid in skipped:
+                    continue
+                return chain(describe(r), child)
+            parent[rid] = child
+            following.append(r)
+        if not following:
+            return None
+        frontier = following
+    return None
 
 
 def memory_usage():
     return Memory(
         os.getpid(),
         resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.)
+
+
+def current_rss():
+    """Resident set size in bytes right now, unlike memory_usage's peak."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError):
+        return None
+
+
+def current_pss():
+    """
+    Proportional set size in bytes, which splits pages shared with other
+    processes (forked workers) between them. Needs Linux 4.14 or later.
+    """
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+    return None
+
+
+class MemorySampler(threading.Thread):
+    """
+    Daemon thread recording memory use every interval seconds into a ring
+    buffer holding the last size samples. Each sample has RSS and PSS from
+    /proc and the gc generation counts. Every census_every samples it also
+    takes a sampled census and keeps the top_types biggest types. If taking
+    samples ever costs more than max_overhead of the time, the interval is
+    stretched to fit.
+
+        sampler = MemorySampler(interval=5)
+        sampler.start()
+        ...
+        with open('mem.jsonl', 'w') as f:
+            sampler.dump_jsonl(f)
+    """
+    _BINARY = struct.Struct('<dqqiii')
+
+    def __init__(self, interval=1.0, size=3600, pss=True, census_every=0,
+                 census_sample=100, top_types=20, max_overhead=0.01):
+        threading.Thread.__init__(self, name='MemorySampler')
+        self.daemon = True
+        self.interval = interval
+        self.pss = pss
+        self.census_every = census_every
+        self.census_sample = census_sample
+        self.top_types = top_types
+        self.max_overhead = max_overhead
+        self._ring = [None] * size
+        self._next = 0
+        self._taken = 0
+        self._busy = 0.0
+        self._start_time = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def sample(self):
+        types = None
+        if self.census_every and self._taken % self.census_every == 0:
+            counts = census(sample=self.census_sample)
+            biggest = sorted(counts.items(), key=lambda kv: -kv[1].size)
+            types = dict((name, c.count)
+                         for name, c in biggest[:self.top_types])
+        gc0, gc1, gc2 = gc.get_count()
+        return Sample(time.time(), current_rss(),
+                      current_pss() if self.pss else None,
+                      gc0, gc1, gc2, types)
+
+    def run(self):
+        self._start_time = time.time()
+        wait = self.interval
+        while not self._stop_event.wait(wait):
+            start = time.time()
+            s = self.sample()
+            with self._lock:
+                self._ring[self._next] = s
+                self._next = (self._next + 1) % len(self._ring)
+                self._taken += 1
+            cost = time.time() - start
+            self._busy += cost
+            wait = max(self.interval, cost / self.max_overhead)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def overhead(self):
+        """Fraction of the elapsed time spent taking samples."""
+        if self._start_time is None:
+            return 0.0
+        return self._busy / max(time.time() - self._start_time, 1e-9)
+
+    def samples(self):
+        """The samples in the ring buffer, oldest first."""
+        with self._lock:
+            ring = self._ring[self._next:] + self._ring[:self._next]
+        return [s for s in ring if s is not None]
+
+    def dump_jsonl(self, f):
+        for s in self.samples():
+            f.write(json.dumps(s._asdict()) + '\n')
+
+    def dump_binary(self, f):
+        """
+        Fixed 36-byte little-endian records of time (double), rss, pss
+        (int64, -1 if unknown) and the three gc counts (int32). Per-type
+        counts are only in the JSON lines.
+        """
+        for s in self.samples():
+            f.write(self._BINARY.pack(
+                s.time, -1 if s.rss is None else s.rss,
+                -1 if s.pss is None else s.pss, s.gc0, s.gc1, s.gc2))
+
+
+class AllocationWindow(object):
+    """
+    Which lines of code allocated the memory that is still live, using
+    tracemalloc for the duration of a with block. Tracing is only stopped
+    at the end if the window started it.
+
+        with AllocationWindow(frames=5) as window:
+            do_some_work()
+        for site in window.growth(top=10):
+            logging.info(site)
+
+    Sites are grouped by 'lineno' (file:line) or by 'traceback' (the whole
+    stack, frames most recent first, up to the frames asked for).
+    """
+
+    _IGNORE = ('<frozen importlib._bootstrap>', '<unknown>')
+
+    def __init__(self, frames=1):
+        if tracemalloc is None:
+            raise RuntimeError('tracemalloc needs Python 3.4 or later')
+        self.frames = frames
+        self.before = self.after = None
+        self._started = False
+
+    def __enter__(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started = True
+        self.before = self._snapshot()
+        return self
+
+    def __exit__(self, *exc):
+        self.after = self._snapshot()
+        if self._started:
+            tracemalloc.stop()
+
+    def _snapshot(self):
+        filters = [tracemalloc.Filter(False, f) for f in self._IGNORE]
+        filters.append(tracemalloc.Filter(False, tracemalloc.__file__))
+        return tracemalloc.take_snapshot().filter_traces(filters)
+
+    def sites(self, by='lineno', top=None):
+        """Live allocations at the end of the window, biggest first."""
+        stats = self.after.statistics(by)
+        return [Site(_where(s.traceback), s.count, s.size)
+                for s in stats[:top]]
+
+    def growth(self, by='lineno', top=None):
+        """What each site allocated and didn't free during the window."""
+        return diff_sites(self.before, self.after, by, top)
+
+
+def diff_sites(before, after, by='lineno', top=None):
+    """
+    Growth per allocation site between two snapshots, or between the ends
+    of two AllocationWindows, biggest growth in bytes first.
+    @return: list of Site(where, count, size) with count and size deltas
+    """
+    if isinstance(before, AllocationWindow):
+        before = before.after
+    if isinstance(after, AllocationWindow):
+        after = after.after
+    growth = [Site(_where(d.traceback), d.count_diff, d.size_diff)
+              for d in after.compare_to(before, by)
+              if d.size_diff or d.count_diff]
+    growth.sort(key=lambda g: (-g.size, -g.count, g.where))
+    return growth[:top] if top is not None else growth
+
+
+def _where(traceback):
+    return ' <- '.join('%s:%d' % (f.filename, f.lineno)
+                       for f in reversed(list(traceback)))
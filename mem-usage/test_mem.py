@@ -2,7 +2,14 @@
 
 import logging
 import gc
-from mem import memory_usage, all_info
+import sys
+import io
+import json
+import time
+import pytest
+from mem import memory_usage, all_info, census, diff_census, deep_size, \
+    retained_sizes, cycles, find_cycles, keepers, CycleFound, MemorySampler, \
+    AllocationWindow, diff_sites, tracemalloc
 
 logging.basicConfig(
     format='%(asctime)-15s  %(levelname)s  %(filename)s:%(lineno)d  %(message)s',
@@ -34,6 +41,157 @@ morass.
 """
 
 
+class Leaky(object):
+    pass
+
+
+def test_census_groups_by_type():
+    found = census([Leaky() for _ in range(100)] + [1.0, 2.0])
+    assert found['test_mem.Leaky'].count == 100
+    assert found[float.__module__ + '.float'].count == 2
+
+
+def test_census_sampling_scales_up():
+    found = census([Leaky() for _ in range(1000)], sample=10)
+    assert found['test_mem.Leaky'].count == 1000
+
+
+def test_diff_census():
+    before = census()
+    leak = [Leaky() for _ in range(500)]
+    growth = diff_census(before, census(), top=5)
+    assert 'test_mem.Leaky' in [g.typename for g in growth]
+    assert [g.count for g in growth if g.typename == 'test_mem.Leaky'] \
+        == [len(leak)]
+
+
+def test_deep_size_counts_shared_once():
+    inner = [1.5, 2.5]
+    outer = [inner, inner, (inner,)]
+    size = deep_size(outer)
+    assert size.count == 5
+    assert size.size == sum(sys.getsizeof(o) for o in
+                            [outer, inner, outer[2], 1.5, 2.5])
+    assert not size.truncated
+
+
+def test_deep_size_limit():
+    assert deep_size([[1.5]] * 3, limit=2).truncated
+
+
+def test_retained_sizes():
+    shared = [float(i) for i in range(1000)]
+    mine = [float(i) for i in range(100)]
+    result = retained_sizes({'a': [shared, mine], 'b': [shared]})
+    assert [r.name for r in result] == ['a', 'b']
+    a, b = result
+    assert a.retained == deep_size(mine).size + sys.getsizeof([shared, mine])
+    assert b.retained == sys.getsizeof([shared])
+    assert b.deep == deep_size([shared]).size
+
+
+def test_shared_reference_is_not_a_cycle():
+    shared = [1.5]
+    assert cycles([shared, shared, (shared,)]) == []
+    find_cycles([shared, shared])
+
+
+def test_cycles():
+    a = [1]
+    b = [a]
+    a.append(b)
+    d = {}
+    d['me'] = d
+    found = cycles([a, d, [2]])
+    assert sorted(len(c) for c in found) == [1, 2]
+    with pytest.raises(CycleFound):
+        find_cycles([a])
+
+
+HOLDER = {'key': [Leaky()]}
+
+
+def test_keepers_module_global():
+    leaked = HOLDER['key'][0]
+    chain = keepers(leaked)
+    assert chain.root == 'module test_mem'
+    assert chain.path == [HOLDER, HOLDER['key'], leaked]
+
+
+def _keepers_of_local(ask):
+    leak = Leaky()
+    return leak, ask(leak)
+
+
+def test_keepers_frame():
+    # the frame holding leak calls another one, which asks
+    leak, chain = _keepers_of_local(lambda o: keepers(o))
+    assert chain.root.endswith('_keepers_of_local')
+    assert chain.path == [leak]
+    leak, chain = _keepers_of_local(
+        lambda o: keepers(o, ignore=[sys._getframe(1)]))
+    # pytest may hold on to it elsewhere, but not through that frame
+    assert chain is None or not chain.root.endswith('_keepers_of_local')
+
+
+def test_sampler_ring_buffer():
+    sampler = MemorySampler(interval=0.01, size=5, census_every=2,
+                            max_overhead=1.0)
+    sampler.start()
+    time.sleep(0.2)
+    sampler.stop()
+    samples = sampler.samples()
+    assert len(samples) == 5
+    assert samples == sorted(samples, key=lambda s: s.time)
+    assert all(s.rss > 0 for s in samples)
+    assert any(s.types for s in samples)
+
+
+def test_sampler_dumps():
+    sampler = MemorySampler(size=10)
+    sampler._ring[:2] = [sampler.sample(), sampler.sample()]
+    sampler._next = 2
+    f = io.BytesIO()
+    sampler.dump_binary(f)
+    assert MemorySampler._BINARY.size == 36
+    assert len(f.getvalue()) == 2 * MemorySampler._BINARY.size
+    f = io.StringIO() if str is not bytes else io.BytesIO()
+    sampler.dump_jsonl(f)
+    lines = f.getvalue().splitlines()
+    assert [json.loads(line)['rss'] for line in lines] == \
+        [s.rss for s in sampler.samples()]
+
+
+needs_tracemalloc = pytest.mark.skipif(tracemalloc is None,
+                                       reason='tracemalloc is Python 3')
+
+
+def allocate_a_lot():
+    return [Leaky() for _ in range(1000)]
+
+
+@needs_tracemalloc
+def test_allocation_window():
+    with AllocationWindow() as window:
+        keep = allocate_a_lot()
+    top = window.growth(top=3)
+    assert 'test_mem.py:%d' % (allocate_a_lot.__code__.co_firstlineno + 1) \
+        in top[0].where
+    assert top[0].count >= len(keep)
+    assert window.sites(top=1)[0].size > 0
+
+
+@needs_tracemalloc
+def test_diff_windows_by_traceback():
+    with AllocationWindow(frames=2) as first:
+        pass
+    with AllocationWindow(frames=2) as second:
+        keep = allocate_a_lot()
+    where = diff_sites(first, second, by='traceback', top=1)[0].where
+    assert ' <- ' in where
+    assert len(keep) == 1000
+
+
 def main():
     for _ in xrange(5):
         logging.debug(memory_usage())
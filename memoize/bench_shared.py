@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+# A pool of forked workers going over the same keys, many times each.
+# With a plain memoize every worker computes every key it sees for
+# itself; with a SharedCache a key computed by any worker is there for
+# all the others.
+
+import logging
+import multiprocessing
+import time
+
+from memoize import memoize
+from shared import SharedCache
+
+logging.basicConfig(
+    format='%(asctime)-15s  %(levelname)s  %(filename)s:%(lineno)d  %(message)s',
+    level=logging.INFO,
+)
+
+KEYS = 64
+ITEMS = 2048
+SLOW = 0.005
+
+computations = multiprocessing.Value('i', 0)
+
+
+def slow(x):
+    with computations.get_lock():
+        computations.value += 1
+    time.sleep(SLOW)
+    return [x] * 10
+
+shared_cache = SharedCache(slots=4 * KEYS)
+per_process = memoize(slow)
+shared = memoize(slow, disk=shared_cache)
+
+
+def call_per_process(x):
+    return per_process(x)
+
+
+def call_shared(x):
+    return shared(x)
+
+
+def run(target, nprocs):
+    computations.value = 0
+    shared_cache.clear()
+    pool = multiprocessing.Pool(nprocs)
+    start = time.time()
+    pool.map(target, [i % KEYS for i in range(ITEMS)], chunksize=16)
+    elapsed = time.time() - start
+    pool.close()
+    pool.join()
+    return ITEMS / elapsed, computations.value
+
+
+def main():
+    for nprocs in (1, 2, 4, 8):
+        for name, target in (('per-process', call_per_process),
+                             ('shared', call_shared)):
+            calls_per_sec, computed = run(target, nprocs)
+            logging.info('procs=%d %-11s %8.0f calls/sec  %4d computations',
+                         nprocs, name, calls_per_sec, computed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+# How memoize holds up with 1 to 32 threads hammering a slow function
+# over a small set of keys. Without threadsafe=True every thread that
+# misses computes the value itself; with it, each key is computed once
+# and everybody else waits for that result. The unguarded cache can
+# also be corrupted by concurrent updates, those errors are counted.
+
+import logging
+import threading
+import time
+
+from memoize import memoize, LRUCache
+
+logging.basicConfig(
+    format='%(asctime)-15s  %(levelname)s  %(filename)s:%(lineno)d  %(message)s',
+    level=logging.INFO,
+)
+
+KEYS = 16
+CALLS_PER_THREAD = 200
+SLOW = 0.01
+
+
+def run(nthreads, threadsafe):
+    computed = []
+    errors = []
+
+    @memoize(cache=LRUCache(maxsize=KEYS), threadsafe=threadsafe)
+    def slow(x):
+        computed.append(x)
+        time.sleep(SLOW)
+        return x * x
+
+    def worker(offset):
+        for i in range(CALLS_PER_THREAD):
+            try:
+                slow((offset + i) % KEYS)
+            except (KeyError, AttributeError) as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n,))
+               for n in range(nthreads)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    return (nthreads * CALLS_PER_THREAD / elapsed,
+            len(computed), len(errors))
+
+
+def main():
+    for nthreads in (1, 2, 4, 8, 16, 32):
+        for threadsafe in (False, True):
+            calls_per_sec, computed, errors = run(nthreads, threadsafe)
+            logging.info('threads=%-2d threadsafe=%-5s %10.0f calls/sec  '
+                         '%4d computations  %3d errors',
+                         nthreads, threadsafe, calls_per_sec, computed, errors)
+
+
+if __name__ == "__main__":
+    main()
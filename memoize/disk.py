@@ -0,0 +1,376 @@
+"""
+On-disk second tier for memoize, shared by every process on the host
+that points at the same directory.
+
+The directory holds two files. "data" is an append-only log of records,
+each one a 20-byte key digest, a 4-byte length and a pickled value.
+"index" is a fixed-size open-addressing hash table, memory-mapped, whose
+slots map a digest to an offset in the data log. Writers serialize on a
+flock of the index; readers take no lock at all, and check the digest
+stored with the record, so a slot that is being written is just a miss.
+Threads of one process share the flock, so they also take a plain lock.
+
+Keys are content addressed: the digest covers the argument values (never
+their ids) and the function's bytecode, so entries written by an older
+version of a function are simply never found again.
+
+    @memoize(disk=DiskCache('/var/tmp/my-memos'))
+    def expensive(x): ...
+
+The data log is never compacted. Records overwritten by fresh=True,
+discarded, or written by an older version of a function stay in it as
+dead weight. clear() is the way to get the space back, and with
+maxbytes a put that would grow the log past that size clears it first.
+"""
+
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import subprocess
+import sys
+import threading
+import types
+import unittest
+
+try:
+    import cPickle as pickle
+except ImportError:     # Python 3
+    import pickle
+
+_SLOT = struct.Struct('>20sQI')       # digest, offset + 1, length
+_RECORD = struct.Struct('>20sI')      # digest, length
+_EMPTY = b'\0' * _SLOT.size
+_PROBES = 64
+
+
+class _Unstable(Exception):
+    pass
+
+
+def _feed(h, x):
+    """Hash x by value, so that equal arguments hash equally in any process."""
+    if x is None or isinstance(x, (bool, int, float, complex)):
+        h.update(('%s:%r;' % (type(x).__name__, x)).encode('utf-8'))
+    elif isinstance(x, bytes):
+        h.update(('b%d:' % len(x)).encode('ascii'))
+        h.update(x)
+    elif isinstance(x, type(u'')):
+        x = x.encode('utf-8')
+        h.update(('u%d:' % len(x)).encode('ascii'))
+        h.update(x)
+    elif isinstance(x, (tuple, list)):
+        h.update(('%s%d(' % (type(x).__name__, len(x))).encode('ascii'))
+        for y in x:
+            _feed(h, y)
+        h.update(b')')
+    elif isinstance(x, (set, frozenset, dict)):
+        # unordered, so sort the members by their own digests
+        if isinstance(x, dict):
+            members = [_digest((k, v)) for k, v in x.items()]
+        else:
+            members = [_digest(y) for y in x]
+        h.update(('%s%d{' % (type(x).__name__, len(x))).encode('ascii'))
+        for m in sorted(members):
+            h.update(m)
+        h.update(b'}')
+    else:
+        try:
+            h.update(pickle.dumps(x, 2))
+        except Exception:
+            raise _Unstable()
+
+
+def _feed_code(h, code):
+    """Hash what a code object does: its bytecode, the globals and
+    attributes it names, and its constants, nested code included."""
+    h.update(code.co_code)
+    _feed(h, code.co_names)
+    h.update(('%d(' % len(code.co_consts)).encode('ascii'))
+    for c in code.co_consts:
+        if isinstance(c, types.CodeType):
+            # repr() of a code object has its address in it
+            _feed_code(h, c)
+        else:
+            _feed(h, c)
+    h.update(b')')
+
+
+def _digest(x):
+    h = hashlib.sha1()
+    _feed(h, x)
+    return h.digest()
+
+
+class ValueKeyed(object):
+    """
+    Keys for second-tier caches, which have to agree across processes
+    and so can only go by argument values and the function's code.
+    """
+
+    def version(self, func):
+        """Digest of what the function is, which changes when its code does."""
+        code = getattr(func, '__code__', None)
+        h = hashlib.sha1()
+        _feed(h, (getattr(func, '__module__', None) or '',
+                  getattr(func, '__name__', '')))
+        if code is not None:
+            _feed_code(h, code)
+        return h.digest()
+
+    def digest(self, version, args, kwargs):
+        """Key for one call, or None if an argument can't be hashed by value."""
+        h = hashlib.sha1(version)
+        try:
+            _feed(h, args)
+            _feed(h, sorted(kwargs.items()))
+        except _Unstable:
+            return None
+        return h.digest()
+
+
+class DiskCache(ValueKeyed):
+    """
+    @param directory: where the index and data files live, created if needed
+    @param slots: index size, fixed when the directory is first created
+    @param maxbytes: size the data log may reach before it is cleared,
+        or None for no limit
+    """
+
+    def __init__(self, directory, slots=1 << 16, maxbytes=None):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.maxbytes = maxbytes
+        fd = os.open(os.path.join(directory, 'index'), os.O_RDWR | os.O_CREAT)
+        self._index_fd = fd
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size == 0:
+                os.ftruncate(fd, slots * _SLOT.size)
+            size = os.fstat(fd).st_size
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self.slots = size // _SLOT.size
+        self._index = mmap.mmap(fd, size)
+        self._data_path = os.path.join(directory, 'data')
+        open(self._data_path, 'ab').close()
+        self._data = open(self._data_path, 'rb')
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.writes = 0
+
+    def close(self):
+        self._index.close()
+        os.close(self._index_fd)
+        self._data.close()
+
+    def _probe(self, digest):
+        start = struct.unpack('>Q', digest[:8])[0] % self.slots
+        for i in range(min(_PROBES, self.slots)):
+            pos = ((start + i) % self.slots) * _SLOT.size
+            yield pos, self._index[pos:pos + _SLOT.size]
+
+    def _read(self, offset, length):
+        with self._lock:
+            return self._read_locked(offset, length)
+
+    def _read_locked(self, offset, length):
+        self._data.seek(offset)
+        record = self._data.read(length)
+        if len(record) != length:
+            # written by another process after we last looked
+            self._data.close()
+            self._data = open(self._data_path, 'rb')
+            self._data.seek(offset)
+            record = self._data.read(length)
+        return record
+
+    def get(self, digest, default=None):
+        for _, slot in self._probe(digest):
+            if slot == _EMPTY:
+                break
+            stored, offset, length = _SLOT.unpack(slot)
+            if stored != digest:
+                continue
+            if offset == 0:
+                break   # discarded
+            record = self._read(offset - 1, length)
+            head = record[:_RECORD.size]
+            if len(head) == _RECORD.size and \
+                    _RECORD.unpack(head) == (digest,
+                                             length - _RECORD.size):
+                self.hits += 1
+                return pickle.loads(record[_RECORD.size:])
+            break
+        self.misses += 1
+        return default
+
+    def put(self, digest, value):
+        """Store value under digest. Values that can't be pickled, or that
+        find the index too crowded, are quietly not stored."""
+        try:
+            payload = pickle.dumps(value, 2)
+        except Exception:
+            return False
+        record = _RECORD.pack(digest, len(payload)) + payload
+        with self._lock:
+            return self._put_locked(digest, record)
+
+    def _put_locked(self, digest, record):
+        fcntl.flock(self._index_fd, fcntl.LOCK_EX)
+        try:
+            for pos, slot in self._probe(digest):
+                if slot == _EMPTY or slot[:20] == digest:
+                    break
+            else:
+                return False
+            with open(self._data_path, 'ab') as f:
+                f.seek(0, os.SEEK_END)
+                offset = f.tell()
+                if self.maxbytes is not None and offset > 0 and \
+                        offset + len(record) > self.maxbytes:
+                    # start over, we hold the flock that clear() takes
+                    self._index[:] = _EMPTY * self.slots
+                    f.truncate(0)
+                    offset = 0
+                    pos, _ = next(self._probe(digest))
+                f.write(record)
+            self._index[pos:pos + _SLOT.size] = \
+                _SLOT.pack(digest, offset + 1, len(record))
+            self.writes += 1
+            return True
+        finally:
+            fcntl.flock(self._index_fd, fcntl.LOCK_UN)
+
+    def discard(self, digest):
+        """Forget digest. Its slot is kept, with no offset, as a tombstone."""
+        with self._lock:
+            fcntl.flock(self._index_fd, fcntl.LOCK_EX)
+            try:
+                for pos, slot in self._probe(digest):
+                    if slot == _EMPTY:
+                        return False
+                    stored, offset, _ = _SLOT.unpack(slot)
+                    if stored == digest:
+                        self._index[pos:pos + _SLOT.size] = \
+                            _SLOT.pack(digest, 0, 0)
+                        return offset != 0
+                return False
+            finally:
+                fcntl.flock(self._index_fd, fcntl.LOCK_UN)
+
+    def clear(self):
+        fcntl.flock(self._index_fd, fcntl.LOCK_EX)
+        try:
+            self._index[:] = _EMPTY * self.slots
+            open(self._data_path, 'wb').close()
+        finally:
+            fcntl.flock(self._index_fd, fcntl.LOCK_UN)
+
+
+class DiskCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory)
+
+    def test_round_trip_and_reopen(self):
+        disk = DiskCache(self.directory, slots=16)
+        key = disk.digest(b'v', (1, 'a'), {'b': [2, 3]})
+        self.assertEqual(disk.get(key, 'nope'), 'nope')
+        self.assertTrue(disk.put(key, {'x': 1}))
+        self.assertEqual(disk.get(key), {'x': 1})
+        disk.close()
+        # another process opening the same directory sees the entry
+        self.assertEqual(DiskCache(self.directory).get(key), {'x': 1})
+
+    def test_digest_is_by_value(self):
+        disk = DiskCache(self.directory)
+        self.assertEqual(disk.digest(b'v', ([1, 2], {3}), {}),
+                         disk.digest(b'v', ([1, 2], {3}), {}))
+        self.assertNotEqual(disk.digest(b'v', (1,), {}),
+                            disk.digest(b'w', (1,), {}))
+        self.assertNotEqual(disk.digest(b'v', (1,), {}),
+                            disk.digest(b'v', (1.0,), {}))
+
+    def test_version_follows_bytecode(self):
+        disk = DiskCache(self.directory)
+
+        def f(x):
+            return x + 1
+        g = f
+
+        def f(x):
+            return x + 2
+        self.assertNotEqual(disk.version(f), disk.version(g))
+
+    def test_version_follows_names(self):
+        disk = DiskCache(self.directory)
+
+        def f(x):
+            return abs(x)
+        g = f
+
+        def f(x):
+            return len(x)
+        self.assertNotEqual(disk.version(f), disk.version(g))
+
+    def test_version_same_in_every_process(self):
+        # nested code objects have an address in their repr()
+        with open(os.path.join(self.directory, 'versioned.py'), 'w') as f:
+            f.write('def double(xs):\n'
+                    '    return [x * 2 for x in xs], lambda: xs\n')
+        here = os.path.dirname(os.path.abspath(__file__))
+        script = ('import sys; sys.path[:0] = %r\n'
+                  'import binascii, disk, versioned\n'
+                  'v = disk.DiskCache(%r).version(versioned.double)\n'
+                  'sys.stdout.write(binascii.hexlify(v).decode())\n'
+                  % ([self.directory, here], self.directory))
+        versions = [subprocess.check_output([sys.executable, '-c', script])
+                    for _ in range(2)]
+        self.assertEqual(versions[0], versions[1])
+
+    def test_maxbytes_clears_the_log(self):
+        disk = DiskCache(self.directory, slots=16, maxbytes=1000)
+        keys = [disk.digest(b'v', (i,), {}) for i in range(50)]
+        for i, key in enumerate(keys):
+            self.assertTrue(disk.put(key, 'x' * 100 + str(i)))
+        self.assertTrue(
+            os.path.getsize(os.path.join(self.directory, 'data')) <= 1000)
+        self.assertEqual(disk.get(keys[-1]), 'x' * 100 + '49')
+        self.assertEqual(disk.get(keys[0]), None)
+
+    def test_memoize_warm_start(self):
+        from memoize import memoize
+        calls = []
+
+        def square(x):
+            calls.append(x)
+            return x * x
+        cold = memoize(square, disk=DiskCache(self.directory))
+        self.assertEqual(cold(3), 9)
+        # a fresh memory tier, as if the process had restarted
+        warm = memoize(square, disk=DiskCache(self.directory))
+        self.assertEqual(warm(3), 9)
+        self.assertEqual(calls, [3])
+
+    def test_invalidate_reaches_disk(self):
+        from memoize import memoize
+        calls = []
+
+        def square(x):
+            calls.append(x)
+            return x * x
+        f = memoize(square, disk=DiskCache(self.directory))
+        f(3)
+        self.assertTrue(f.invalidate(3))
+        f(3)
+        self.assertEqual(calls, [3, 3])
+        # and the slot can be used again
+        self.assertEqual(memoize(square, disk=DiskCache(self.directory))(3), 9)
+        self.assertEqual(calls, [3, 3])
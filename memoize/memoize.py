@@ -1,30 +1,551 @@
+import gc
+import sys
+import threading
+import time
 import unittest
+import weakref
+from collections import OrderedDict, namedtuple
 from functools import wraps
 
-_cache = {}
+try:
+    import asyncio
+except ImportError:     # Python 2
+    asyncio = None
 
+CacheStats = namedtuple('CacheStats',
+                        ['hits', 'misses', 'evictions', 'size', 'nbytes'])
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'evictions', 'size',
+                                     'nbytes', 'hit_ratio'])
 
-def memoize(func):
+_missing = object()
+
+
+class Cache(object):
+    """
+    Cache policy for memoize. Entries live in an OrderedDict so that every
+    operation is O(1). This base class evicts in insertion order (FIFO);
+    subclasses decide which entry goes first by overriding _touch, _add,
+    _discard and _victim. If on_remove is set, it is called with the key
+    of every entry that leaves the cache, however it leaves.
+    @param maxsize: maximum number of entries, or None for no limit
+    @param maxbytes: maximum total of sizeof(value), or None for no limit
+    @param ttl: seconds an entry stays valid, or None for forever
+    """
+
+    def __init__(self, maxsize=None, maxbytes=None, ttl=None,
+                 sizeof=sys.getsizeof, timer=time.time):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self._sizeof = sizeof
+        self._timer = timer
+        self._data = OrderedDict()   # key -> (value, nbytes, expires)
+        self.nbytes = 0
+        self.hits = self.misses = self.evictions = 0
+        self.on_remove = None
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _missing, count=False) is not _missing
+
+    def __getitem__(self, key):
+        value = self.get(key, _missing, count=False)
+        if value is _missing:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.put(key, value)
+
+    def __delitem__(self, key):
+        if key not in self._data:
+            raise KeyError(key)
+        self._remove(key)
+
+    def pop(self, key, default=None):
+        if key not in self._data:
+            return default
+        value = self._data[key][0]
+        self._remove(key)
+        return value
+
+    def get(self, key, default=None, count=True):
+        entry = self._data.get(key)
+        if entry is not None and entry[2] is not None \
+                and entry[2] <= self._timer():
+            self._remove(key)
+            self.evictions += 1
+            entry = None
+        if entry is None:
+            if count:
+                self.misses += 1
+            return default
+        if count:
+            self.hits += 1
+        self._touch(key)
+        return entry[0]
+
+    def put(self, key, value):
+        if key in self._data:
+            self._remove(key)
+        nbytes = self._sizeof(value) if self.maxbytes is not None else 0
+        if self.maxbytes is not None and nbytes > self.maxbytes:
+            # would never fit, don't flush everything else trying
+            return False
+        # make room first, so that the newcomer is never its own victim
+        while self._data and (
+                (self.maxsize is not None and
+                 len(self._data) >= self.maxsize) or
+                (self.maxbytes is not None and
+                 self.nbytes + nbytes > self.maxbytes)):
+            self._remove(self._victim())
+            self.evictions += 1
+        expires = self._timer() + self.ttl if self.ttl is not None else None
+        self._data[key] = (value, nbytes, expires)
+        self.nbytes += nbytes
+        self._add(key)
+        return True
+
+    def clear(self):
+        for key in list(self._data):
+            self._remove(key)
+
+    def stats(self):
+        return CacheStats(self.hits, self.misses, self.evictions,
+                          len(self._data), self.nbytes)
+
+    def approx_bytes(self):
+        """Shallow size of the values, only kept up to date under maxbytes."""
+        if self.maxbytes is not None:
+            return self.nbytes
+        return sum(self._sizeof(entry[0]) for entry in self._data.values())
+
+    def _remove(self, key):
+        _, nbytes, _ = self._data.pop(key)
+        self.nbytes -= nbytes
+        self._discard(key)
+        if self.on_remove is not None:
+            self.on_remove(key)
+
+    # policy hooks
+
+    def _touch(self, key):
+        pass
+
+    def _add(self, key):
+        pass
+
+    def _discard(self, key):
+        pass
+
+    def _victim(self):
+        return next(iter(self._data))
+
+
+class LRUCache(Cache):
+    """Evicts the least recently used entry."""
+
+    def _touch(self, key):
+        # OrderedDict in 2.7 has no move_to_end, pop and re-insert is O(1)
+        self._data[key] = self._data.pop(key)
+
+
+class LFUCache(Cache):
+    """
+    Evicts the least frequently used entry, oldest first among ties.
+    Keys are kept in one OrderedDict per use count, and the lowest count
+    in use is tracked, so finding a victim doesn't scan the entries.
+    """
+
+    def __init__(self, *args, **kwargs):
+        Cache.__init__(self, *args, **kwargs)
+        self._freq = {}       # key -> use count
+        self._buckets = {}    # use count -> OrderedDict of keys
+        self._min_freq = 0
+
+    def _unlink(self, key):
+        freq = self._freq.pop(key)
+        bucket = self._buckets[freq]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[freq]
+            if self._min_freq == freq:
+                self._min_freq = freq + 1
+        return freq
+
+    def _link(self, key, freq):
+        self._freq[key] = freq
+        self._buckets.setdefault(freq, OrderedDict())[key] = None
+
+    def _touch(self, key):
+        self._link(key, self._unlink(key) + 1)
+
+    def _add(self, key):
+        self._link(key, 1)
+        self._min_freq = 1
+
+    def _discard(self, key):
+        self._unlink(key)
+        if not self._freq:
+            self._min_freq = 0
+        elif self._min_freq not in self._buckets:
+            self._min_freq = min(self._buckets)
+
+    def _victim(self):
+        return next(iter(self._buckets[self._min_freq]))
+
+
+try:
+    _primitive = (int, long, float, str, complex, unicode, bool, type(None))
+except NameError:       # Python 3
+    _primitive = (int, float, str, bytes, complex, bool, type(None))
+_by_value = _primitive + (tuple, frozenset)
+_by_id = object()
+_kwd_mark = (object(),)     # between positional and keyword arguments
+
+
+class _Uncacheable(Exception):
+    pass
+
+
+def _key_part(x, referents):
+    """
+    Primitives and tuples are keyed by value. Anything that can be weakly
+    referenced is keyed by identity and appended to referents, so the
+    entry can be dropped when x dies, before its id gets reused. Whatever
+    is left is keyed by value if hashable, otherwise can't be cached.
+    """
+    if isinstance(x, _by_value):
+        pass
+    elif type(x).__weakrefoffset__:
+        referents.append(x)
+        return (_by_id, id(x))
+    try:
+        hash(x)
+    except TypeError:
+        raise _Uncacheable()
+    return x
+
+
+def _make_key(args, kwargs, referents):
+    key = tuple([_key_part(x, referents) for x in args])
+    if kwargs:
+        key += _kwd_mark + tuple([(k, _key_part(v, referents))
+                                  for k, v in sorted(kwargs.items())])
+    return key
+
+
+# tag -> memoized functions holding entries with that tag
+_by_tag = {}
+
+
+def invalidate_tag(tag):
+    """
+    Drop the entries of every memoized function that were tagged with tag.
+    @return: the number of entries dropped
+    """
+    return sum(f.invalidate_tag(tag) for f in list(_by_tag.get(tag, ())))
+
+
+def _running_loop():
+    try:
+        return asyncio.get_running_loop()
+    except AttributeError:      # before 3.7
+        return asyncio._get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def _task_loop(task):
+    get_loop = getattr(task, 'get_loop', None)   # 3.7
+    return get_loop() if get_loop is not None else task._loop
+
+
+class _NoLock(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+class _Flight(object):
+    """A computation in progress, which other callers of its key wait for."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = self.error = None
+
+
+def memoize(func=None, cache=None, threadsafe=False, disk=None, tags=None):
     """
     Decorator that memoizes a function. The memoized function can use "fresh=True"
-    to avoid using cached results.
+    to avoid using cached results. Each memoized function gets its own cache,
+    available as its "cache" attribute.
+
+        @memoize
+        def f(x): ...
+
+        @memoize(cache=LRUCache(maxsize=1000, ttl=60))
+        def g(x): ...
+
+    Arguments that are instances are keyed by identity, and their entries go
+    away when they are garbage collected. Calls with unhashable arguments
+    that can't be weakly referenced (lists, dicts) are never cached.
+
+    With threadsafe=True, concurrent callers of the same key wait for a
+    single computation and share its result (or its exception). The
+    function's lock is only held while touching the cache, never while
+    computing, so different keys are computed in parallel.
+
+    Coroutine functions (async def) are detected. Called from a running
+    event loop, the memoized version returns an asyncio Task rather than
+    a coroutine, and caches the task, so every caller of a key awaits the
+    same one, whether it is still running or already done. Tasks that
+    fail or get cancelled are evicted, and so is a task still pending in
+    another loop. Called with no loop running, as in asyncio.run(f(x)),
+    it returns the plain coroutine and caches nothing.
+
+    A disk.DiskCache can be given as a second tier behind the in-memory
+    cache, so results survive a restart and are shared by processes on
+    the host, or a shared.SharedCache, to share them between the forked
+    children of one process. Either one is keyed by argument values and
+    the function's bytecode. Neither is used for coroutine functions,
+    tasks can't be pickled.
+
+    The memoized function has some attributes for operators:
+        cache_info()   hits, misses, evictions, entries, bytes, hit ratio
+        cache_clear()  drop everything in memory
+        invalidate(*args, **kwargs)   drop the entry for one call, in the
+                       second tier as well
+        invalidate_tag(tag)   drop the entries tagged with tag
+    Tags are given per function, or computed per call by a function taking
+    the same arguments. Module-level invalidate_tag does every function.
     @param func: the function to be memoized
+    @param cache: a Cache instance, default is a new unbounded Cache
+    @param threadsafe: guard the cache and dedupe concurrent computations
+    @param disk: optional DiskCache or SharedCache to consult on a miss
+        and write through to
+    @param tags: a tag or tags for every entry, or a function of the call
+        arguments returning tags for that entry
     @return: the function with memoization
     """
+    if func is None:
+        return lambda f: memoize(f, cache=cache, threadsafe=threadsafe,
+                                 disk=disk, tags=tags)
+    store = Cache() if cache is None else cache
+    watched = {}   # id(referent) -> (weakref, set of keys mentioning it)
+    mentions = {}  # key -> ids of the referents it mentions
+    # reentrant, a weakref callback can fire while we hold it
+    lock = threading.RLock() if threadsafe else _NoLock()
+    in_flight = {}   # key -> _Flight
+    tagged = {}      # tag -> set of keys
+    key_tags = {}    # key -> its tags
+    if tags is None:
+        tags_for = lambda args, kwargs: ()
+    elif callable(tags):
+        tags_for = lambda args, kwargs: tags(*args, **kwargs)
+    else:
+        static_tags = (tags,) if isinstance(tags, str) else tuple(tags)
+        tags_for = lambda args, kwargs: static_tags
+
+    def forget(oid):
+        def callback(_):
+            with lock:
+                _, keys = watched.pop(oid, (None, ()))
+                for key in keys:
+                    store.pop(key)
+        return callback
+
+    def watch(key, referents):
+        for x in referents:
+            oid = id(x)
+            if oid not in watched:
+                watched[oid] = (weakref.ref(x, forget(oid)), set())
+            watched[oid][1].add(key)
+        if referents:
+            mentions[key] = [id(x) for x in referents]
+
+    def removed(key):
+        # the cache let go of key, evicted or not, so stop watching for it
+        for oid in mentions.pop(key, ()):
+            entry = watched.get(oid)
+            if entry is not None:
+                entry[1].discard(key)
+                if not entry[1]:
+                    del watched[oid]
+        for tag in key_tags.pop(key, ()):
+            keys = tagged.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del tagged[tag]
+                    funcs = _by_tag.get(tag)
+                    if funcs is not None:
+                        funcs.discard(newfunc)
+                        if not funcs:
+                            del _by_tag[tag]
+    store.on_remove = removed
+
+    def track(key, referents, args, kwargs):
+        watch(key, referents)
+        tags = tuple(tags_for(args, kwargs))
+        if tags:
+            key_tags[key] = tags
+        for tag in tags:
+            if tag not in tagged:
+                tagged[tag] = set()
+                _by_tag.setdefault(tag, weakref.WeakSet()).add(newfunc)
+            tagged[tag].add(key)
+
+    version = disk.version(func) if disk is not None else None
+
+    def compute(args, kwargs, fresh):
+        if disk is None:
+            return func(*args, **kwargs)
+        digest = disk.digest(version, args, kwargs)
+        if digest is not None and not fresh:
+            value = disk.get(digest, _missing)
+            if value is not _missing:
+                return value
+        value = func(*args, **kwargs)
+        if digest is not None:
+            disk.put(digest, value)
+        return value
 
-    def short(x, primitive=(int, long, float, str, complex, unicode, bool)):
-        return x if isinstance(x, primitive) else id(x)
+    def evict_failed(key, task):
+        def callback(_):
+            if task.cancelled() or task.exception() is not None:
+                with lock:
+                    if store.get(key, count=False) is task:
+                        store.pop(key)
+        return callback
+
+    @wraps(func)
+    def newcoro(*args, **kwargs):
+        fresh = kwargs.pop('fresh', False)
+        loop = _running_loop()
+        if loop is None:
+            # a task would belong to no loop, or the wrong one
+            return func(*args, **kwargs)
+        referents = []
+        try:
+            key = _make_key(args, kwargs, referents)
+        except _Uncacheable:
+            return asyncio.ensure_future(func(*args, **kwargs))
+        with lock:
+            task = _missing if fresh else store.get(key, _missing)
+            if task is not _missing and not task.done() and \
+                    _task_loop(task) is not loop:
+                # can't be awaited from here, and may never finish
+                store.pop(key)
+                task = _missing
+            if task is _missing:
+                task = asyncio.ensure_future(func(*args, **kwargs))
+                if store.put(key, task):
+                    track(key, referents, args, kwargs)
+                task.add_done_callback(evict_failed(key, task))
+        return task
 
     @wraps(func)
     def newfunc(*args, **kwargs):
         fresh = kwargs.pop('fresh', False)
-        key = (id(func), ) + (
-            tuple([short(x) for x in args]) +
-            tuple([(short(k), short(v)) for k, v in kwargs.items()])
-        )
-        if fresh or key not in _cache:
-            _cache[key] = func(*args, **kwargs)
-        return _cache[key]
+        referents = []
+        try:
+            key = _make_key(args, kwargs, referents)
+        except _Uncacheable:
+            return compute(args, kwargs, fresh)
+        if not threadsafe:
+            value = _missing if fresh else store.get(key, _missing)
+            if value is _missing:
+                value = compute(args, kwargs, fresh)
+                if store.put(key, value):
+                    track(key, referents, args, kwargs)
+            return value
+
+        with lock:
+            value = _missing if fresh else store.get(key, _missing)
+            if value is not _missing:
+                return value
+            flight = in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = in_flight[key] = _Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        try:
+            flight.value = compute(args, kwargs, fresh)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with lock:
+                del in_flight[key]
+                if flight.error is None and store.put(key, flight.value):
+                    track(key, referents, args, kwargs)
+            flight.done.set()
+        return flight.value
+
+    def cache_info():
+        with lock:
+            stats = store.stats()
+            nbytes = store.approx_bytes()
+        lookups = stats.hits + stats.misses
+        return CacheInfo(stats.hits, stats.misses, stats.evictions,
+                         stats.size, nbytes,
+                         float(stats.hits) / lookups if lookups else 0.0)
+
+    def cache_clear():
+        with lock:
+            store.clear()
+            tagged.clear()
+            watched.clear()
+
+    def invalidate(*args, **kwargs):
+        try:
+            key = _make_key(args, kwargs, [])
+        except _Uncacheable:
+            key = _missing
+        with lock:
+            found = store.pop(key, _missing) is not _missing
+        if disk is not None:
+            digest = disk.digest(version, args, kwargs)
+            if digest is not None:
+                found = disk.discard(digest) or found
+        return found
+
+    def invalidate_tag(tag):
+        with lock:
+            # each pop drops the key from tagged, and the tag once empty
+            keys = list(tagged.get(tag, ()))
+            return len([key for key in keys
+                        if store.pop(key, _missing) is not _missing])
+
+    def bookkeeping():
+        # what is kept about the cached keys outside the cache, for tests
+        with lock:
+            return {
+                'watched': dict((oid, len(keys))
+                                for oid, (_, keys) in watched.items()),
+                'mentions': len(mentions),
+                'tagged': dict((tag, len(keys))
+                               for tag, keys in tagged.items()),
+                'key_tags': len(key_tags),
+            }
+
+    if asyncio is not None and asyncio.iscoroutinefunction(func):
+        newfunc = newcoro
+    newfunc.cache = store
+    newfunc.cache_info = cache_info
+    newfunc.cache_clear = cache_clear
+    newfunc.invalidate = invalidate
+    newfunc.invalidate_tag = invalidate_tag
+    newfunc._bookkeeping = bookkeeping
     return newfunc
 
 
@@ -49,20 +570,246 @@ class MemoizeTest(unittest.TestCase):
     def test1(self):
         foo = Foo()
         self.assertEqual(foo.my_tuple, ('a', 'b', 'c'))
-        my_tuple = Foo.my_tuple.fget.func_closure[0].cell_contents
-        key = (id(my_tuple), id(foo),)
-        self.assertEqual(_cache[key], ('a', 'b', 'c'))
+        cache = Foo.my_tuple.fget.cache
+        key = ((_by_id, id(foo)),)
+        self.assertEqual(cache[key], ('a', 'b', 'c'))
         self.assertEqual(foo.my_tuple, ('a', 'b', 'c'))
-        self.assertEqual(_cache[key], ('a', 'b', 'c'))
+        self.assertEqual(cache[key], ('a', 'b', 'c'))
 
     def test2(self):
         foo = Foo()
-        my_none = Foo.my_none.fget.func_closure[0].cell_contents
+        cache = Foo.my_none.fget.cache
         self.assertEqual(foo.my_none, None)
-        key = (id(my_none), id(foo),)
-        self.assertEqual(_cache[key], None)
+        key = ((_by_id, id(foo)),)
+        self.assertEqual(cache[key], None)
         self.assertEqual(foo.my_none, None)
-        self.assertEqual(_cache[key], None)
+        self.assertEqual(cache[key], None)
+
+    def test_entries_die_with_instance(self):
+        cache = Foo.my_tuple.fget.cache
+        before = len(cache)
+        foo = Foo()
+        foo.my_tuple
+        self.assertEqual(len(cache), before + 1)
+        del foo
+        gc.collect()
+        self.assertEqual(len(cache), before)
+
+    def test_caches_are_per_function(self):
+        self.assertIsNot(Foo.my_tuple.fget.cache, Foo.my_none.fget.cache)
+
+    def test_unhashable_args_not_cached(self):
+        calls = []
+
+        @memoize
+        def total(lst):
+            calls.append(lst)
+            return sum(lst)
+        self.assertEqual(total([1, 2]), 3)
+        self.assertEqual(total([1, 2]), 3)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(len(total.cache), 0)
+
+    def test_keyword_args_keyed_apart(self):
+        @memoize
+        def echo(*args, **kwargs):
+            return args, kwargs
+        self.assertEqual(echo(('x', 1)), ((('x', 1),), {}))
+        self.assertEqual(echo(x=1), ((), {'x': 1}))
+
+    def test_evicted_entries_not_watched(self):
+        class Bar(object):
+            pass
+        bar = Bar()
+
+        @memoize(cache=LRUCache(maxsize=10))
+        def pair(obj, i):
+            return i
+        for i in range(1000):
+            pair(bar, i)
+        self.assertEqual(len(pair.cache), 10)
+        kept = pair._bookkeeping()
+        self.assertEqual(kept['watched'], {id(bar): 10})
+        self.assertEqual(kept['mentions'], 10)
+        pair.cache_clear()
+        self.assertEqual(pair._bookkeeping()['mentions'], 0)
+
+
+class InvalidationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = calls = []
+
+        @memoize(tags=lambda user, page: ['user:%d' % user])
+        def render(user, page):
+            calls.append((user, page))
+            return '%d/%d' % (user, page)
+        self.render = render
+
+    def test_cache_info(self):
+        self.render(1, 1)
+        self.render(1, 1)
+        self.render(1, 1)
+        self.render(1, 2)
+        info = self.render.cache_info()
+        self.assertEqual((info.hits, info.misses, info.size), (2, 2, 2))
+        self.assertEqual(info.hit_ratio, 0.5)
+        self.assertTrue(info.nbytes > 0)
+
+    def test_invalidate(self):
+        self.render(1, 1)
+        self.render(1, 2)
+        self.assertTrue(self.render.invalidate(1, 1))
+        self.assertFalse(self.render.invalidate(1, 1))
+        self.render(1, 1)
+        self.render(1, 2)
+        self.assertEqual(self.calls, [(1, 1), (1, 2), (1, 1)])
+
+    def test_invalidate_tag(self):
+        self.render(1, 1)
+        self.render(1, 2)
+        self.render(2, 1)
+        self.assertEqual(self.render.invalidate_tag('user:1'), 2)
+        self.assertEqual(self.render.cache_info().size, 1)
+        self.assertEqual(self.render.invalidate_tag('user:1'), 0)
+
+    def test_invalidate_tag_everywhere(self):
+        @memoize(tags='config')
+        def setting(name):
+            return name.upper()
+
+        @memoize(tags=['config', 'flags'])
+        def flag(name):
+            return name.lower()
+        setting('a')
+        setting('b')
+        flag('c')
+        self.assertEqual(invalidate_tag('config'), 3)
+        self.assertEqual(invalidate_tag('flags'), 0)
+
+    def test_evicted_entries_untagged(self):
+        @memoize(cache=LRUCache(maxsize=10), tags=lambda i: ['item:%d' % i])
+        def item(i):
+            return i
+        for i in range(1000):
+            item(i)
+        kept = item._bookkeeping()
+        self.assertEqual(len(kept['tagged']), 10)
+        self.assertEqual(kept['key_tags'], 10)
+        self.assertFalse('item:0' in _by_tag)
+        self.assertTrue(item.invalidate(999))
+        kept = item._bookkeeping()
+        self.assertEqual(len(kept['tagged']), 9)
+        self.assertFalse('item:999' in kept['tagged'])
+        self.assertEqual(kept['key_tags'], 9)
+        self.assertFalse('item:999' in _by_tag)
+
+    def test_cache_clear(self):
+        self.render(1, 1)
+        self.render.cache_clear()
+        self.assertEqual(self.render.cache_info().size, 0)
+        self.render(1, 1)
+        self.assertEqual(len(self.calls), 2)
+
+
+class ThreadSafeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.go = threading.Event()
+
+    def _hammer(self, func, nthreads=8):
+        errors = []
+
+        def call():
+            try:
+                func(1)
+            except ValueError as e:
+                errors.append(e)
+        threads = [threading.Thread(target=call) for _ in range(nthreads)]
+        for t in threads:
+            t.start()
+        # let every thread pile up behind the first computation
+        time.sleep(0.1)
+        self.go.set()
+        for t in threads:
+            t.join()
+        return errors
+
+    def test_single_flight(self):
+        calls = []
+
+        @memoize(threadsafe=True)
+        def slow(x):
+            calls.append(x)
+            self.go.wait()
+            return x
+        self.assertEqual(self._hammer(slow), [])
+        self.assertEqual(calls, [1])
+        self.assertEqual(slow(1), 1)
+
+    def test_shared_exception_not_cached(self):
+        calls = []
+
+        @memoize(threadsafe=True)
+        def fails(x):
+            calls.append(x)
+            self.go.wait()
+            raise ValueError(x)
+        self.assertEqual(len(self._hammer(fails)), 8)
+        self.assertEqual(calls, [1])
+        self.assertEqual(len(fails.cache), 0)
+
+
+class CachePolicyTest(unittest.TestCase):
+
+    def test_lru_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertEqual(sorted(cache._data), ['a', 'c'])
+        self.assertEqual(cache.stats().evictions, 1)
+
+    def test_lfu_evicts_least_frequently_used(self):
+        cache = LFUCache(maxsize=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.get('a')
+        cache.get('b')
+        cache.put('c', 3)
+        self.assertEqual(sorted(cache._data), ['a', 'c'])
+        cache.put('d', 4)
+        self.assertEqual(sorted(cache._data), ['a', 'd'])
+
+    def test_maxbytes(self):
+        cache = LRUCache(maxbytes=10, sizeof=len)
+        cache.put('a', 'xxxx')
+        cache.put('b', 'xxxx')
+        cache.put('c', 'xxxx')
+        self.assertEqual(sorted(cache._data), ['b', 'c'])
+        self.assertEqual(cache.nbytes, 8)
+
+    def test_ttl(self):
+        now = [0.0]
+        cache = Cache(ttl=10, timer=lambda: now[0])
+        cache.put('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        now[0] = 11.0
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.stats(), CacheStats(1, 1, 1, 0, 0))
+
+    def test_memoize_with_cache(self):
+        calls = []
+
+        @memoize(cache=LRUCache(maxsize=1))
+        def double(x):
+            calls.append(x)
+            return 2 * x
+        self.assertEqual([double(1), double(1), double(2), double(1)],
+                         [2, 2, 4, 2])
+        self.assertEqual(calls, [1, 2, 1])
 
 
-print "To test this, type: nosetests memoize.py"
+print("To test this, type: nosetests memoize.py")
@@ -0,0 +1,198 @@
+"""
+Second tier for memoize that lives in anonymous shared memory, so that
+a result computed in one forked child (multiprocessing.Pool, or the
+fork-per-item map in procmap/foo.py) is visible to all its siblings.
+Create it in the parent, before forking:
+
+    cache = SharedCache()
+
+    @memoize(disk=cache)
+    def expensive(x): ...
+
+    multiprocessing.Pool(8).map(expensive, items)
+
+The memory is a fixed array of fixed-size slots, each holding a sequence
+number, a key digest, a length and a pickled value. Slots are found by
+hashing the digest with a short linear probe, and when every probed slot
+is taken the first one is overwritten. Writers take one of a handful of
+multiprocessing locks picked by slot number. Readers take no lock: the
+sequence number is odd while a write is in progress and bumped again at
+the end, so a reader that sees it odd or changed reports a miss.
+"""
+
+import mmap
+import multiprocessing
+import struct
+import unittest
+
+from disk import ValueKeyed
+
+try:
+    import cPickle as pickle
+except ImportError:     # Python 3
+    import pickle
+
+_HEAD = struct.Struct('=I20sI')     # sequence, digest, length
+_SEQ = struct.Struct('=I')
+_NULL = b'\0' * 20
+_PROBES = 8
+
+
+class SharedCache(ValueKeyed):
+    """
+    @param slots: number of entries
+    @param slot_bytes: largest pickled value that will be stored
+    @param stripes: number of writer locks
+    """
+
+    def __init__(self, slots=4096, slot_bytes=1024, stripes=16):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self._stride = _HEAD.size + slot_bytes
+        self._mem = mmap.mmap(-1, slots * self._stride)
+        self._locks = [multiprocessing.Lock() for _ in range(stripes)]
+        # per process, like the counters of Cache
+        self.hits = self.misses = self.writes = 0
+
+    def _probe(self, digest):
+        start = struct.unpack('>Q', digest[:8])[0] % self.slots
+        for i in range(min(_PROBES, self.slots)):
+            yield (start + i) % self.slots
+
+    def get(self, digest, default=None):
+        mem = self._mem
+        for slot in self._probe(digest):
+            pos = slot * self._stride
+            seq, stored, length = _HEAD.unpack_from(mem, pos)
+            if seq == 0:
+                break
+            if stored != digest:
+                continue
+            payload = mem[pos + _HEAD.size:pos + _HEAD.size + length]
+            if seq & 1 or _SEQ.unpack_from(mem, pos)[0] != seq:
+                break   # being rewritten under our feet
+            self.hits += 1
+            return pickle.loads(payload)
+        self.misses += 1
+        return default
+
+    def put(self, digest, value):
+        """Store value under digest, unless it pickles bigger than a slot."""
+        try:
+            payload = pickle.dumps(value, 2)
+        except Exception:
+            return False
+        if len(payload) > self.slot_bytes:
+            return False
+        mem = self._mem
+        victim = free = first = None
+        for slot in self._probe(digest):
+            seq, stored, _ = _HEAD.unpack_from(mem, slot * self._stride)
+            if seq != 0 and stored == digest:
+                victim = slot
+                break
+            if free is None and (seq == 0 or stored == _NULL):
+                free = slot
+            if first is None:
+                first = slot
+            if seq == 0:
+                break   # never used, the digest can't be further along
+        if victim is None:
+            # not stored yet, take a blank slot, or else the first one
+            victim = free if free is not None else first
+        pos = victim * self._stride
+        with self._locks[victim % len(self._locks)]:
+            seq = _SEQ.unpack_from(mem, pos)[0]
+            _SEQ.pack_into(mem, pos, seq + 1)
+            mem[pos + _HEAD.size:pos + _HEAD.size + len(payload)] = payload
+            _HEAD.pack_into(mem, pos, seq + 1, digest, len(payload))
+            _SEQ.pack_into(mem, pos, seq + 2)
+        self.writes += 1
+        return True
+
+    def discard(self, digest):
+        """Forget digest, by blanking the digest stored in its slot."""
+        mem = self._mem
+        for slot in self._probe(digest):
+            pos = slot * self._stride
+            seq, stored, _ = _HEAD.unpack_from(mem, pos)
+            if seq == 0:
+                return False
+            if stored != digest:
+                continue
+            with self._locks[slot % len(self._locks)]:
+                seq, stored, _ = _HEAD.unpack_from(mem, pos)
+                if stored != digest:
+                    return False
+                _HEAD.pack_into(mem, pos, seq + 1, _NULL, 0)
+                _SEQ.pack_into(mem, pos, seq + 2)
+            return True
+        return False
+
+    def clear(self):
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            self._mem[:] = b'\0' * len(self._mem)
+        finally:
+            for lock in self._locks:
+                lock.release()
+
+
+class SharedCacheTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        cache = SharedCache(slots=4)
+        key = cache.digest(b'v', (1,), {})
+        self.assertEqual(cache.get(key, 'nope'), 'nope')
+        self.assertTrue(cache.put(key, [1, 2]))
+        self.assertEqual(cache.get(key), [1, 2])
+
+    def test_too_big(self):
+        cache = SharedCache(slots=4, slot_bytes=16)
+        key = cache.digest(b'v', (1,), {})
+        self.assertFalse(cache.put(key, 'x' * 100))
+        self.assertEqual(cache.get(key), None)
+
+    def test_full_table_overwrites(self):
+        cache = SharedCache(slots=2)
+        keys = [cache.digest(b'v', (i,), {}) for i in range(3)]
+        for i, key in enumerate(keys):
+            self.assertTrue(cache.put(key, i))
+        self.assertEqual(cache.get(keys[2]), 2)
+
+    def test_discard(self):
+        cache = SharedCache(slots=4)
+        key = cache.digest(b'v', (1,), {})
+        cache.put(key, 1)
+        self.assertTrue(cache.discard(key))
+        self.assertFalse(cache.discard(key))
+        self.assertEqual(cache.get(key), None)
+        cache.put(key, 2)
+        self.assertEqual(cache.get(key), 2)
+
+    def test_rewrite_after_discard_keeps_one_slot(self):
+        cache = SharedCache(slots=4)
+        # both start probing at the same slot
+        a = b'\0' * 7 + b'\1' + b'a' * 12
+        k = b'\0' * 7 + b'\5' + b'k' * 12
+        cache.put(a, 'a')
+        cache.put(k, 'old')
+        cache.discard(a)
+        cache.put(k, 'new')
+        self.assertEqual(cache.get(k), 'new')
+        self.assertTrue(cache.discard(k))
+        self.assertEqual(cache.get(k), None)
+
+    def test_visible_across_fork(self):
+        from memoize import memoize
+        cache = SharedCache()
+
+        def square(x):
+            return x * x
+        child = multiprocessing.Process(
+            target=memoize(square, disk=cache), args=(7,))
+        child.start()
+        child.join()
+        key = cache.digest(cache.version(square), (7,), {})
+        self.assertEqual(cache.get(key), 49)
@@ -0,0 +1,105 @@
+# Python 3 only, async def is a syntax error in Python 2.
+# python3 -m pytest test_async.py
+
+import asyncio
+
+import pytest
+from memoize import memoize
+
+
+def run(coro):
+    return asyncio.new_event_loop().run_until_complete(coro)
+
+
+def test_caches_awaited_result():
+    calls = []
+
+    @memoize
+    async def double(x):
+        calls.append(x)
+        return 2 * x
+
+    async def main():
+        return [await double(1), await double(1), await double(2)]
+    assert run(main()) == [2, 2, 4]
+    assert calls == [1, 2]
+
+
+def test_concurrent_awaiters_share_one_task():
+    calls = []
+
+    @memoize
+    async def slow(x):
+        calls.append(x)
+        await asyncio.sleep(0.01)
+        return x
+
+    async def main():
+        return await asyncio.gather(*[slow(1) for _ in range(10)])
+    assert run(main()) == [1] * 10
+    assert calls == [1]
+
+
+def test_failed_task_is_evicted():
+    calls = []
+
+    @memoize
+    async def flaky(x):
+        calls.append(x)
+        if len(calls) == 1:
+            raise ValueError(x)
+        return x
+
+    async def main():
+        with pytest.raises(ValueError):
+            await flaky(1)
+        return await flaky(1)
+    assert run(main()) == 1
+    assert calls == [1, 1]
+
+
+def test_asyncio_run_twice():
+    calls = []
+
+    @memoize
+    async def double(x):
+        calls.append(x)
+        return 2 * x
+    assert asyncio.run(double(1)) == 2
+    assert asyncio.run(double(1)) == 2
+    # outside any loop nothing is cached, there is no task to share
+    assert calls == [1, 1]
+    assert len(double.cache) == 0
+
+
+def test_pending_task_of_another_loop_replaced():
+    calls = []
+
+    @memoize
+    async def stuck(x):
+        calls.append(x)
+        await asyncio.sleep(3600)
+
+    @memoize
+    async def quick(x):
+        calls.append(x)
+        return x
+
+    async def start():
+        stuck(1)
+        return quick(1)
+    first = asyncio.new_event_loop()
+    assert first.run_until_complete(first.run_until_complete(start())) == 1
+
+    async def main():
+        done, pending = await asyncio.wait([stuck(1)], timeout=0.01)
+        assert not done
+        return await quick(1)
+    # a finished task is good anywhere, a pending one only in its loop
+    assert asyncio.run(main()) == 1
+    assert calls == [1, 1, 1]
+    left = asyncio.all_tasks(first)
+    for task in left:
+        task.cancel()
+    first.run_until_complete(asyncio.gather(*left, return_exceptions=True))
+    first.close()
@@ -87,34 +87,577 @@ Tests should be
     - don't declare variables you don't need
 """
 
-class Pojo(object):
-    def __init__(self, *args):
-        if len(args) != len(self.__fields__):
-            raise TypeError((args, self.__fields__))
-        for arg, (name, _type) in zip(args, self.__fields__):
-            import datetime
-            if isinstance(_type, type):
-                if _type in (int, float, complex, str):
-                    try:
-                        arg = _type(arg)
-                    except:
-                        pass
-                elif _type in (datetime.date,
-                               datetime.datetime,
-                               datetime.timedelta):
-                    # I'll get to these real soon now
-                    raise NotImplementedError(_type)
+import datetime
+import gc
+import math
+import struct
+import weakref
+from contextlib import contextmanager
+from itertools import repeat
+from operator import attrgetter, itemgetter
+
+try:
+    import cPickle as pickle
+except ImportError:     # Python 3
+    import pickle
+
+try:
+    from itertools import imap
+except ImportError:     # Python 3
+    imap = map
+
+_COERCED = (int, float, complex, str)
+_NOT_YET = (datetime.date, datetime.datetime, datetime.timedelta)
+
+
+def _field_check(i, _type):
+    """Source lines validating (and maybe coercing) argument a<i>."""
+    a, t = 'a%d' % i, 't%d' % i
+    fail = 'raise TypeError((n%d, %s, %s))' % (i, a, t)
+    if isinstance(_type, type):
+        if _type in _COERCED:
+            return ['if type({0}) is not {1}:'.format(a, t),
+                    '    try:',
+                    '        {0} = {1}({0})'.format(a, t),
+                    '    except Exception:',
+                    '        pass',
+                    '    if not isinstance({0}, {1}):'.format(a, t),
+                    '        ' + fail]
+        elif _type in _NOT_YET:
+            # I'll get to these real soon now
+            return ['raise NotImplementedError(%s)' % t]
+        return ['if not isinstance({0}, {1}):'.format(a, t),
+                '    ' + fail]
+    elif callable(_type):
+        return ['if not {0}({1}):'.format(t, a),
+                '    ' + fail]
+    return [fail]
+
+
+def _check_column(name, _type, column):
+    """
+    Validate (and maybe coerce) a whole column of values for one field,
+    the way __init__ would one at a time, but in bulk.
+    @return: the column, coerced where needed
+    """
+    if not column:
+        return column
+    if isinstance(_type, type):
+        if _type in _COERCED:
+            if set(imap(type, column)) == set([_type]):
+                return column
+            try:
+                coerced = list(imap(_type, column))
+                if set(imap(type, coerced)) == set([_type]):
+                    return coerced
+            except Exception:
+                pass
+            # coerce one at a time, to find the one that won't go
+            checked = []
+            for arg in column:
+                try:
+                    arg = _type(arg)
+                except Exception:
+                    pass
                 if not isinstance(arg, _type):
-                    # coercion failed
                     raise TypeError((name, arg, _type))
-            elif callable(_type):
-                if not _type(arg):
+                checked.append(arg)
+            return checked
+        elif _type in _NOT_YET:
+            raise NotImplementedError(_type)
+        if not all(imap(isinstance, column, repeat(_type))):
+            for arg in column:
+                if not isinstance(arg, _type):
                     raise TypeError((name, arg, _type))
-            else:
+        return column
+    elif callable(_type):
+        for arg in column:
+            if not _type(arg):
                 raise TypeError((name, arg, _type))
-            # https://stackoverflow.com/questions/12998926#answer-12999019
-            self.__dict__[name] = arg
+        return column
+    raise TypeError((name, column[0], _type))
+
+
+@contextmanager
+def _gc_paused():
+    """
+    Making a million records would set off a garbage collection every
+    few hundred of them, each one going over every record made so far,
+    while records can't form cycles.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _store_lines(fields, setters, namespace):
+    if setters is not None:
+        for i, setter in enumerate(setters):
+            namespace['s%d' % i] = setter
+        return ['    s%d(self, a%d)' % (i, i) for i in range(len(fields))]
+    if not fields:
+        return []
+    # https://stackoverflow.com/questions/12998926#answer-12999019
+    return ['    d = self.__dict__'] + \
+        ['    d[n%d] = a%d' % (i, i) for i in range(len(fields))]
+
+
+def _compile_build(cls, fields, setters=None):
+    """
+    Build a function making an instance of cls from values already
+    validated, without going through __init__.
+    """
+    namespace = {'cls': cls, 'new': object.__new__}
+    args = ', '.join('a%d' % i for i in range(len(fields)))
+    lines = ['def build(%s):' % args,
+             '    self = new(cls)']
+    for i, (name, _) in enumerate(fields):
+        namespace['n%d' % i] = name
+    lines.extend(_store_lines(fields, setters, namespace))
+    lines.append('    return self')
+    exec(compile('\n'.join(lines), '<pojo build %s>' % cls.__name__, 'exec'),
+         namespace)
+    return namespace['build']
+
+
+def _compile_init(fields, setters=None):
+    """
+    Build the __init__ for one set of __fields__, as straight-line code
+    with the validators bound as globals, so that constructing an
+    instance doesn't go through any of the per-field decisions again.
+    Values go into __dict__, or through setters, one per field, if given.
+    """
+    namespace = {'fields': fields}
+    lines = ['def __init__(self, *args):',
+             '    if len(args) != %d:' % len(fields),
+             '        raise TypeError((args, fields))']
+    if fields:
+        lines.append('    %s, = args' %
+                     ', '.join('a%d' % i for i in range(len(fields))))
+    for i, (name, _type) in enumerate(fields):
+        namespace['n%d' % i] = name
+        namespace['t%d' % i] = _type
+        lines.extend('    ' + line for line in _field_check(i, _type))
+    lines.extend(_store_lines(fields, setters, namespace))
+    exec(compile('\n'.join(lines), '<pojo %r>' % (fields,), 'exec'),
+         namespace)
+    return namespace['__init__']
+
+
+_TEXT = str is not bytes     # Python 3 str has to be encoded
+_COUNT = struct.Struct('<I')
+
+
+def _compile_codec(cls):
+    """
+    Build (encode, decode) for cls's records. A record is one struct of
+    its numeric fields and the lengths of the others, followed by those
+    others: str as UTF-8, nested Pojos encoded the same way unless they
+    are of a subclass of the field's type, anything else pickled.
+    decode(buf, pos) reads one record from a memoryview at pos, slicing
+    it rather than copying, and returns (record, next pos).
+    """
+    namespace = {'build': cls._build, 'pickle': pickle, 'complex': complex}
+    head = ['<']
+    packed, unpacked = [], []
+    extra_encode, extra_decode = [], []
+    for i, (name, _type) in enumerate(cls.__fields__):
+        v = 'v%d' % i
+        if _type is int:
+            head.append('q')
+            packed.append(v)
+            unpacked.append(v)
+            continue
+        elif _type is float:
+            head.append('d')
+            packed.append(v)
+            unpacked.append(v)
+            continue
+        elif _type is complex:
+            head.append('dd')
+            packed.extend([v + '.real', v + '.imag'])
+            unpacked.extend(['r%d' % i, 'i%d' % i])
+            extra_decode.append('%s = complex(r%d, i%d)' % (v, i, i))
+            continue
+        # everything else goes after the struct, preceded by its length
+        head.append('I')
+        packed.append('len(%s)' % v)
+        unpacked.append('n%d' % i)
+        end = 'pos + n%d' % i
+        if _type is str:
+            if _TEXT:
+                extra_encode.append('%s = %s.encode("utf-8")' % (v, v))
+                extra_decode.append('%s = str(buf[pos:%s], "utf-8")' %
+                                    (v, end))
+            else:
+                extra_decode.append('%s = buf[pos:%s].tobytes()' % (v, end))
+        elif isinstance(_type, type) and issubclass(_type, Pojo):
+            namespace['e%d' % i], namespace['d%d' % i] = _type._codec()
+            namespace['T%d' % i] = _type
+            # a subclass instance would lose its class and extra fields
+            # in _type's layout, so it is pickled, and flagged as such
+            head.append('?')
+            packed.append('f%d' % i)
+            unpacked.append('f%d' % i)
+            extra_encode.append('f%d = type(%s) is not T%d' % (i, v, i))
+            extra_encode.append('%s = pickle.dumps(%s, 2) if f%d '
+                                'else e%d(%s)' % (v, v, i, i, v))
+            extra_decode.append('%s = pickle.loads(buf[pos:%s].tobytes()) '
+                                'if f%d else d%d(buf, pos)[0]'
+                                % (v, end, i, i))
+        else:
+            extra_encode.append('%s = pickle.dumps(%s, 2)' % (v, v))
+            extra_decode.append('%s = pickle.loads(buf[pos:%s].tobytes())' %
+                                (v, end))
+        extra_decode.append('pos = %s' % end)
+        extra_encode.append('rest.append(%s)' % v)
+    namespace['head'] = struct.Struct(''.join(head))
+    names = [name for name, _ in cls.__fields__]
+    namespace['get'] = attrgetter(*names) if names else None
+    values = ', '.join('v%d' % i for i in range(len(names)))
+    lines = ['def encode(self):', '    rest = []']
+    if names:
+        lines.append('    %s, = %s' % (values, 'get(self)' if len(names) > 1
+                                         else '[get(self)]'))
+    lines.extend('    ' + line for line in extra_encode)
+    lines.append('    return b"".join([head.pack(%s)] + rest)' %
+                 ', '.join(packed))
+    lines.append('def decode(buf, pos):')
+    if unpacked:
+        lines.append('    %s, = head.unpack_from(buf, pos)' %
+                     ', '.join(unpacked))
+    lines.append('    pos += head.size')
+    lines.extend('    ' + line for line in extra_decode)
+    lines.append('    return build(%s), pos' % values)
+    exec(compile('\n'.join(lines), '<pojo codec %s>' % cls.__name__,
+                 'exec'), namespace)
+    return namespace['encode'], namespace['decode']
+
+
+class _PojoType(type):
+    """
+    Compiles each class's __fields__ into its __init__, once. Below a
+    CompactPojo the fields also become __slots__.
+    """
+
+    def __new__(mcs, name, bases, namespace):
+        if any(getattr(base, '_compact', False) for base in bases) and \
+                '__slots__' not in namespace:
+            taken = set()
+            for base in bases:
+                for klass in base.__mro__:
+                    taken.update(klass.__dict__.get('__slots__', ()))
+            slots = [field for field, _ in namespace.get('__fields__', ())
+                     if field not in taken]
+            if any(getattr(base, '_interned', False) for base in bases) \
+                    and '__weakref__' not in taken:
+                slots.append('__weakref__')     # for the intern table
+            namespace['__slots__'] = tuple(slots)
+        return type.__new__(mcs, name, bases, namespace)
+
+    def __init__(cls, name, bases, namespace):
+        type.__init__(cls, name, bases, namespace)
+        fields = getattr(cls, '__fields__', None)
+        if fields is None:
+            return
+        fields = list(fields)
+        setters = None
+        if cls._compact:
+            # the slots' own descriptors, as __setattr__ is closed
+            setters = [getattr(cls, field).__set__ for field, _ in fields]
+        if '__fields__' in namespace:
+            cls._init = init = _compile_init(fields, setters)
+            # a hand-written __init__ up the tree gets to run, it
+            # reaches cls._init through Pojo.__init__
+            if '__init__' not in namespace and not _custom_init(cls):
+                cls.__init__ = init
+        # even with inherited fields, as it makes instances of cls
+        cls._build = staticmethod(_compile_build(cls, fields, setters))
+
+
+def _custom_init(cls):
+    """Whether constructing cls runs a hand-written __init__."""
+    owner = [k for k in cls.__mro__ if '__init__' in vars(k)][0]
+    return owner is not Pojo and \
+        vars(owner)['__init__'] is not vars(owner).get('_init')
+
+
+class _InternedType(_PojoType):
+    """Hands out the existing equal instance, if there is one."""
+
+    def __init__(cls, name, bases, namespace):
+        _PojoType.__init__(cls, name, bases, namespace)
+        fields = getattr(cls, '__fields__', None)
+        if fields is None:
+            return
+        cls._table = weakref.WeakValueDictionary()  # _interned_key -> instance
+        if len(fields) == 1:
+            get = attrgetter(fields[0][0])
+            cls._values = staticmethod(lambda obj: (get(obj),))
+        elif fields:
+            cls._values = staticmethod(attrgetter(*[f for f, _ in fields]))
+        else:
+            cls._values = staticmethod(lambda obj: ())
+        build = cls._build
+        cls._build = staticmethod(lambda *args: cls._intern(build(*args)))
+
+    def __call__(cls, *args, **kwargs):
+        return cls._intern(_PojoType.__call__(cls, *args, **kwargs))
+
+
+class Pojo(_PojoType('PojoBase', (object,), {'__slots__': ()})):
+    # subclasses still get a __dict__, unless they are CompactPojos
+    __slots__ = ()
+    _compact = False
+
+    def __init__(self, *args):
+        # only reached by classes with an __init__ of their own
+        self._init(*args)
 
     def __setattr__(self, name, value):
         # instances are frozen after creation
         raise TypeError(name)
+
+    @classmethod
+    def from_columns(cls, columns):
+        """
+        Validate whole columns at once, much faster than constructing
+        the instances one by one, and return a Columns that makes the
+        instances as they are asked for. Any bad value raises the same
+        TypeError construction would, though not necessarily the same
+        bad value, as columns are checked one after the other.
+
+            >>> class Foo(Pojo):
+            ...     __fields__ = [("x", int), ("y", float)]
+            >>> foos = Foo.from_columns({"x": ["1", 2], "y": [3, 4.5]})
+            >>> len(foos), foos[0].x, foos[0].y
+            (2, 1, 3.0)
+            >>> [foo.y for foo in foos]
+            [3.0, 4.5]
+
+        @param columns: field name -> sequence of values
+        """
+        names = [name for name, _ in cls.__fields__]
+        if sorted(columns) != sorted(names):
+            raise TypeError((sorted(columns), cls.__fields__))
+        return cls._from_columns([columns[name] for name in names])
+
+    @classmethod
+    def _from_columns(cls, columns):
+        columns = [c if isinstance(c, (list, tuple)) else list(c)
+                   for c in columns]
+        lengths = set(imap(len, columns))
+        if len(lengths) > 1:
+            raise TypeError(('columns of unequal length', lengths))
+        return Columns(cls, [_check_column(name, _type, column)
+                             for (name, _type), column
+                             in zip(cls.__fields__, columns)],
+                       lengths.pop() if lengths else 0)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Like constructing cls(*row) for every row, but validating a
+        column at a time, and not stopping for the garbage collector.
+        A hand-written __init__ still runs, once per row.
+        @return: list of instances
+        """
+        rows = rows if isinstance(rows, list) else list(rows)
+        width = len(cls.__fields__)
+        if not width or _custom_init(cls):
+            with _gc_paused():
+                return [cls(*row) for row in rows]
+        if set(imap(len, rows)) - set([width]):
+            for row in rows:
+                if len(row) != width:
+                    raise TypeError((row, cls.__fields__))
+        with _gc_paused():
+            columns = [list(imap(itemgetter(i), rows)) for i in range(width)]
+            return list(cls._from_columns(columns))
+
+    @classmethod
+    def _codec(cls):
+        codec = cls.__dict__.get('_codec_')
+        if codec is None:
+            codec = _compile_codec(cls)
+            cls._codec_ = codec
+        return codec
+
+    def to_bytes(self):
+        """
+        A compact encoding of this record, laid out by __fields__ rather
+        than naming them like pickle does. int fields have to fit in 64
+        bits.
+
+            >>> class Foo(Pojo):
+            ...     __fields__ = [("x", int), ("z", str)]
+            >>> Foo.from_bytes(Foo(12, "howdy").to_bytes()).z
+            'howdy'
+        """
+        return type(self)._codec()[0](self)
+
+    @classmethod
+    def from_bytes(cls, buf):
+        """Decode what to_bytes made, from bytes or any buffer."""
+        return cls._codec()[1](memoryview(buf), 0)[0]
+
+    @classmethod
+    def many_to_bytes(cls, records):
+        encode = cls._codec()[0]
+        encoded = [encode(record) for record in records]
+        return b''.join([_COUNT.pack(len(encoded))] + encoded)
+
+    @classmethod
+    def many_from_bytes(cls, buf):
+        """Decode what many_to_bytes made, into a list."""
+        decode = cls._codec()[1]
+        buf = memoryview(buf)
+        count, = _COUNT.unpack_from(buf, 0)
+        records = []
+        append = records.append
+        pos = _COUNT.size
+        with _gc_paused():
+            for _ in range(count):
+                record, pos = decode(buf, pos)
+                append(record)
+        return records
+
+
+class Columns(object):
+    """
+    Validated records of one Pojo class, stored a column per field. An
+    instance is made whenever one is indexed or iterated over, through
+    the class's hand-written __init__ if it has one.
+    """
+
+    def __init__(self, cls, columns, length):
+        self.cls = cls
+        self._columns = columns
+        self._length = length
+        self._make = cls if _custom_init(cls) else cls._build
+
+    def column(self, name):
+        for (field, _), column in zip(self.cls.__fields__, self._columns):
+            if field == name:
+                return column
+        raise KeyError(name)
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._make(*row)
+                    for row in zip(*[column[i] for column in self._columns])]
+        return self._make(*[column[i] for column in self._columns])
+
+    def __iter__(self):
+        if not self._columns:
+            return (self._make() for _ in range(self._length))
+        return imap(self._make, *self._columns)
+
+
+class CompactPojo(Pojo):
+    """
+    A Pojo that keeps its fields in __slots__ rather than a __dict__,
+    several times smaller for records of a few small fields. Validation
+    and freezing are the same; instances just can't grow attributes
+    that aren't fields.
+
+        >>> class Point(CompactPojo):
+        ...     __fields__ = [("x", int), ("y", int)]
+        >>> p = Point(1, "2")
+        >>> p.y
+        2
+        >>> hasattr(p, '__dict__')
+        False
+    """
+    __slots__ = ()
+    _compact = True
+
+    def __reduce__(self):
+        # pickle's default for slots would go through __setattr__
+        return type(self), tuple(getattr(self, field)
+                                 for field, _ in self.__fields__)
+
+
+def _shape(v):
+    # what == leaves out: the types all the way down, and signs of zeros
+    t = type(v)
+    if t is float:
+        return t, math.copysign(1., v)
+    if t is complex:
+        return t, math.copysign(1., v.real), math.copysign(1., v.imag)
+    if isinstance(v, tuple):
+        return t, tuple(map(_shape, v))
+    if isinstance(v, frozenset):
+        return t, frozenset((m, _shape(m)) for m in v)
+    return t
+
+
+_plain = frozenset([bool, int, float, str, bytes, type(None)])
+
+
+def _interned_key(values):
+    # 1 == 1.0 == True and 0.0 == -0.0, but they aren't interchangeable,
+    # nor are (1,) and (True,)
+    types = tuple(map(type, values))
+    if _plain.issuperset(types) and not (float in types and 0 in values):
+        return types, values
+    return types, values, tuple(map(_shape, values))
+
+
+class InternedPojo(_InternedType('InternedBase', (Pojo,), {'__slots__': ()})):
+    """
+    A Pojo of which there is only ever one instance per set of field
+    values, as long as any is alive: constructing an equal one gives
+    back the existing instance. Equal means of the same type, with field
+    values that are equal and of the same types, down into tuples and
+    frozensets, 0.0 and -0.0 counting as different. The hash is computed once, so instances make good dict
+    keys and comparing equal ones is mostly an identity check. Field
+    values must be hashable. Mix in CompactPojo for slots as well.
+
+        >>> class Point(InternedPojo, CompactPojo):
+        ...     __fields__ = [("x", int), ("y", int)]
+        >>> Point(1, 2) is Point("1", 2)
+        True
+        >>> len(set([Point(1, 2), Point(1, 2), Point(2, 1)]))
+        2
+    """
+    __slots__ = ('_hash',)
+    _interned = True
+
+    @classmethod
+    def _intern(cls, obj):
+        key = _interned_key(cls._values(obj))
+        existing = cls._table.get(key)
+        if existing is not None:
+            return existing
+        _set_hash(obj, hash((cls, key)))
+        cls._table[key] = obj
+        return obj
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if type(other) is not type(self) or self._hash != other._hash:
+            return False
+        return _interned_key(self._values(self)) == \
+            _interned_key(other._values(other))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __reduce__(self):
+        # unpickling goes through the constructor, and so the table
+        return type(self), self._values(self)
+
+
+_set_hash = InternedPojo._hash.__set__
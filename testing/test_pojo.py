@@ -1,5 +1,5 @@
 import pytest
-from pojo import Pojo
+from pojo import Pojo, CompactPojo, InternedPojo
 
 """
 ## Testing notes
@@ -163,3 +163,262 @@ def test_frozen_nested_instance():
         foo.bar.x = 10
     assert isinstance(foo.bar, Bar)
     assert foo.bar.x == 12
+
+
+def test_inherited_fields():
+    class Foo(Pojo):
+        __fields__ = [("x", int)]
+    class Bar(Foo):
+        pass
+    assert Bar("12").x == 12
+    with pytest.raises(TypeError):
+        Bar("xyzzy")
+
+
+def test_own_init_still_validates():
+    class Foo(Pojo):
+        __fields__ = [("x", int)]
+        def __init__(self, x=0):
+            Pojo.__init__(self, x)
+    assert Foo().x == 0
+    assert Foo("12").x == 12
+    with pytest.raises(TypeError):
+        Foo("xyzzy")
+
+
+def test_compact_pojo():
+    class Bar(CompactPojo):
+        __fields__ = [("x", int)]
+    class Foo(CompactPojo):
+        __fields__ = [("bar", Bar), ("y", float)]
+    foo = Foo(Bar("12"), 3)
+    assert foo.bar.x == 12 and foo.y == 3.0
+    assert not hasattr(foo, '__dict__')
+    with pytest.raises(TypeError):
+        foo.y = 4.0
+    with pytest.raises(TypeError):
+        Foo(Bar("xyzzy"), 3)
+    with pytest.raises(TypeError):
+        Foo(12, 3)
+
+
+def test_compact_pojo_subclass_adds_fields():
+    class Foo(CompactPojo):
+        __fields__ = [("x", int)]
+    class Bar(Foo):
+        __fields__ = [("x", int), ("y", int)]
+    bar = Bar(1, 2)
+    assert (bar.x, bar.y) == (1, 2)
+    assert not hasattr(bar, '__dict__')
+
+
+def test_compact_pojo_pickles():
+    import pickle
+    foo = CompactPoint(1, 2)
+    for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+        copy = pickle.loads(pickle.dumps(foo, protocol))
+        assert (copy.x, copy.y) == (1, 2)
+
+
+class CompactPoint(CompactPojo):
+    # pickle needs to find the class at module level
+    __fields__ = [("x", int), ("y", int)]
+
+
+def test_from_rows():
+    class Foo(Pojo):
+        __fields__ = [("x", int),
+                      ("y", float)]
+    foos = Foo.from_rows([("12", 1), (13, 2.5)])
+    assert [(foo.x, foo.y) for foo in foos] == [(12, 1.0), (13, 2.5)]
+    assert isinstance(foos[0], Foo) and isinstance(foos[0].y, float)
+    assert Foo.from_rows([]) == []
+    with pytest.raises(TypeError):
+        Foo.from_rows([(12, 1.0), ("xyzzy", 2.0)])
+    with pytest.raises(TypeError):
+        Foo.from_rows([(12, 1.0), (13,)])
+    with pytest.raises(TypeError):
+        foos[0].x = 14
+
+
+def test_from_columns():
+    class Bar(Pojo):
+        __fields__ = [("x", int)]
+    class Foo(CompactPojo):
+        __fields__ = [("bar", Bar),
+                      ("z", str)]
+    bars = [Bar(1), Bar(2)]
+    foos = Foo.from_columns({"bar": bars, "z": ["a", 3+4j]})
+    assert len(foos) == 2
+    assert foos.column("z") == ["a", "(3+4j)"]
+    assert [foo.bar.x for foo in foos] == [1, 2]
+    assert [foo.z for foo in foos[1:]] == ["(3+4j)"]
+    with pytest.raises(TypeError):
+        Foo.from_columns({"bar": [1, 2], "z": ["a", "b"]})
+    with pytest.raises(TypeError):
+        Foo.from_columns({"bar": bars, "z": ["a"]})
+    with pytest.raises(TypeError):
+        Foo.from_columns({"bar": bars})
+
+
+def test_inherited_custom_init_kept():
+    class Foo(Pojo):
+        __fields__ = [("x", int)]
+        def __init__(self, x=0):
+            Pojo.__init__(self, x)
+    class Bar(Foo):
+        __fields__ = [("x", int)]
+    class Baz(Bar):
+        __fields__ = [("x", str)]
+    assert Bar().x == 0
+    assert Bar(3).x == 3
+    assert Baz().x == "0"
+    class Qux(Pojo):
+        __fields__ = [("x", int)]
+    class Quux(Qux):
+        __fields__ = [("x", int), ("y", int)]
+    assert Quux.__init__ is not Qux.__init__
+    assert Quux(1, 2).y == 2
+
+
+def test_from_rows_of_subclass():
+    class Foo(Pojo):
+        __fields__ = [("x", int)]
+    class Bar(Foo):
+        pass
+    assert type(Bar.from_rows([(1,)])[0]) is Bar
+
+
+def test_bulk_loading_runs_custom_init():
+    class Foo(Pojo):
+        __fields__ = [("x", int)]
+    class Bar(Foo):
+        def __init__(self, x):
+            Foo.__init__(self, x * 10)
+    class Baz(Bar):
+        pass
+    assert Bar(1).x == 10
+    assert [bar.x for bar in Bar.from_rows([(1,), (2,)])] == [10, 20]
+    bars = Baz.from_columns({"x": [1, 2]})
+    assert bars[0].x == 10
+    assert [baz.x for baz in bars[:]] == [10, 20]
+    assert [baz.x for baz in bars] == [10, 20]
+    assert type(bars[1]) is Baz
+    assert [foo.x for foo in Foo.from_rows([(1,)])] == [1]
+
+
+def test_binary_round_trip():
+    class Bar(CompactPojo):
+        __fields__ = [("x", int)]
+    class Foo(Pojo):
+        __fields__ = [("x", int),
+                      ("y", float),
+                      ("c", complex),
+                      ("z", str),
+                      ("bar", Bar),
+                      ("tags", lambda tags: isinstance(tags, list))]
+    foo = Foo(-12, 2.5, 3+4j, "howdy", Bar(7), ["a", 1])
+    copy = Foo.from_bytes(bytearray(foo.to_bytes()))
+    assert (copy.x, copy.y, copy.c, copy.z, copy.bar.x, copy.tags) == \
+        (-12, 2.5, 3+4j, "howdy", 7, ["a", 1])
+    assert isinstance(copy.bar, Bar)
+    with pytest.raises(TypeError):
+        copy.x = 1
+
+
+def test_binary_nested_subclass():
+    class Foo(Pojo):
+        __fields__ = [("bar", NestedBar), ("z", str)]
+    foo = Foo(NestedSubBar(1, "extra"), "howdy")
+    copy = Foo.from_bytes(foo.to_bytes())
+    assert type(copy.bar) is NestedSubBar
+    assert (copy.bar.x, copy.bar.y, copy.z) == (1, "extra", "howdy")
+    copy = Foo.from_bytes(Foo(NestedBar(2), "").to_bytes())
+    assert type(copy.bar) is NestedBar
+
+
+def test_binary_many():
+    class Foo(Pojo):
+        __fields__ = [("x", int),
+                      ("z", str)]
+    foos = Foo.from_rows([(i, str(i)) for i in range(5)])
+    copies = Foo.many_from_bytes(Foo.many_to_bytes(foos))
+    assert [(foo.x, foo.z) for foo in copies] == \
+        [(i, str(i)) for i in range(5)]
+    assert Foo.many_from_bytes(Foo.many_to_bytes([])) == []
+
+
+def test_interned_pojo():
+    class Foo(InternedPojo):
+        __fields__ = [("x", int),
+                      ("z", str)]
+    foo = Foo(12, "howdy")
+    assert Foo("12", "howdy") is foo
+    assert Foo(13, "howdy") is not foo
+    assert Foo(13, "howdy") != foo
+    assert {foo: 1}[Foo(12, "howdy")] == 1
+    assert Foo.from_rows([(12, "howdy")])[0] is foo
+    with pytest.raises(TypeError):
+        foo.x = 13
+
+
+def test_interned_pojo_keeps_types():
+    class Foo(InternedPojo):
+        __fields__ = [("v", float)]
+    class Bar(InternedPojo):
+        __fields__ = [("v", lambda v: True)]
+    zero = Foo(0.0)
+    assert str(Foo(-0.0).v) == "-0.0"
+    assert Foo(0.0) is zero
+    assert type(Bar(1.0).v) is float
+    assert Bar(True).v is True
+    assert Bar(1).v is not True
+    assert Bar(1) != Bar(True)
+
+
+def test_interned_pojo_keeps_types_of_members():
+    class Foo(InternedPojo):
+        __fields__ = [("v", lambda v: v)]
+    assert Foo((True,)).v == (1,)
+    assert Foo((1,)).v[0] is not True
+    assert str(Foo((0.0,)).v) == "(0.0,)"
+    assert str(Foo((-0.0,)).v) == "(-0.0,)"
+    assert str(Foo(((-0.0, 1),)).v) == "((-0.0, 1),)"
+    assert type(list(Foo(frozenset([1.0])).v)[0]) is float
+    assert type(list(Foo(frozenset([1])).v)[0]) is int
+    assert Foo((1, 2)) is Foo((1, 2))
+    assert Foo((1,)) != Foo((True,))
+
+
+def test_interned_pojo_is_weak():
+    import gc
+    import weakref
+    class Foo(InternedPojo, CompactPojo):
+        __fields__ = [("x", int)]
+    foo = Foo(12)
+    assert not hasattr(foo, '__dict__')
+    ref = weakref.ref(foo)
+    del foo
+    gc.collect()
+    assert ref() is None
+    assert len(Foo._table) == 0
+
+
+def test_interned_pojo_pickles():
+    import pickle
+    point = InternedPoint(1, 2)
+    for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+        assert pickle.loads(pickle.dumps(point, protocol)) is point
+
+
+class InternedPoint(InternedPojo):
+    __fields__ = [("x", int), ("y", int)]
+
+
+class NestedBar(Pojo):
+    __fields__ = [("x", int)]
+
+
+class NestedSubBar(NestedBar):
+    # module level, so that pickle can find it
+    __fields__ = [("x", int), ("y", str)]
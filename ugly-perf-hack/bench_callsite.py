@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+# What it costs to find out who called us, per call: the way
+# ProfilerHack.context used to (traceback.extract_stack, which walks the
+# whole stack and reads source lines), inspect.stack(), and sys._getframe
+# with the pretty name cached by code object as context does now. Then a
+# disabled-handler log call through the stock findCaller and the patched
+# one from perf.py, and a whole ProfilerHack.context entry.
+
+import inspect
+import logging
+import sys
+import timeit
+import traceback
+
+stock_find_caller = logging.Logger.findCaller
+import perf     # pylint: disable=wrong-import-position
+patched_find_caller = logging.Logger.findCaller
+
+CALLS = 5000
+DEPTH = 30
+
+hack = perf.ProfilerHack()
+
+
+def by_extract_stack():
+    filename, line, _, _ = traceback.extract_stack()[-2]
+    return hack.pretty_name(filename, line, 'x')
+
+
+def by_inspect():
+    frame = inspect.stack()[1][0]
+    return hack.pretty_name(frame.f_code.co_filename, frame.f_lineno, 'x')
+
+
+names = {}
+
+
+def by_getframe():
+    f = sys._getframe(1)
+    key = (f.f_code, f.f_lineno)
+    name = names.get(key)
+    if name is None:
+        name = names[key] = hack.pretty_name(f.f_code.co_filename,
+                                             f.f_lineno, 'x')
+    return name
+
+
+def log_call():
+    logger.info('x')
+
+
+def context_entry():
+    with hack.context('x'):
+        pass
+
+
+def at_depth(n, f):
+    """Call f from n frames down, as it would be in real code."""
+    if n:
+        return at_depth(n - 1, f)
+    return timeit.timeit(f, number=CALLS)
+
+
+logger = logging.getLogger('bench_callsite')
+logger.propagate = False
+logger.addHandler(logging.NullHandler())
+logger.setLevel(logging.INFO)
+
+
+def main():
+    rows = [
+        ('traceback.extract_stack', by_extract_stack, None),
+        ('inspect.stack', by_inspect, None),
+        ('sys._getframe + cache', by_getframe, None),
+        ('log, stock findCaller', log_call, stock_find_caller),
+        ('log, patched findCaller', log_call, patched_find_caller),
+        ('ProfilerHack.context', context_entry, None),
+    ]
+    for name, f, find_caller in rows:
+        logging.Logger.findCaller = find_caller or patched_find_caller
+        per_call = at_depth(DEPTH, f) / CALLS
+        logging.Logger.findCaller = patched_find_caller
+        logging.info('%-25s %8.2f usec/call', name, per_call * 1e6)
+
+
+if __name__ == "__main__":
+    main()
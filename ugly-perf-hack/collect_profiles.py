@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+"""
+Merge the binary profiles that profile_to_log(..., dump=directory) leaves
+behind, from any number of processes and hosts, and show where the time
+went, or how it moved between two builds.
+
+    collect_profiles.py /shared/profiles/*.prof
+    collect_profiles.py --sort tottime --top 20 --out merged.prof prof/
+    collect_profiles.py --diff old-build/ new-build/
+
+Arguments are .prof files or directory trees holding them. The merged result is
+an ordinary pstats file, so it also opens in pstats, snakeviz and the
+like. Profiles have to come from the same Python version, it's marshal
+underneath.
+"""
+
+import argparse
+import os
+import pstats
+import sys
+
+SORTS = {
+    'cumulative': 3,    # index into the pstats (cc, nc, tt, ct) tuple
+    'tottime': 2,
+    'calls': 1,
+}
+
+
+def profile_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, names in sorted(os.walk(path)):
+                for name in sorted(names):
+                    if name.endswith('.prof'):
+                        yield os.path.join(directory, name)
+        else:
+            yield path
+
+
+def merge(paths):
+    """
+    @param paths: .prof files and directories of them
+    @return: (pstats.Stats of them all, number of profiles merged)
+    """
+    stats = None
+    count = 0
+    for path in profile_files(paths):
+        if stats is None:
+            stats = pstats.Stats(path)
+        else:
+            stats.add(path)
+        count += 1
+    if stats is None:
+        raise ValueError('no profiles in %s' % ' '.join(paths))
+    return stats, count
+
+
+def func_name(func):
+    filename, line, name = func
+    if filename == '~':     # builtins
+        return name
+    return '%s:%d(%s)' % (filename, line, name)
+
+
+def top(stats, sort, n, out=sys.stdout):
+    rows = sorted(stats.stats.items(),
+                  key=lambda item: item[1][SORTS[sort]], reverse=True)
+    out.write('%12s %12s %12s  %s\n' % ('ncalls', 'tottime', 'cumtime',
+                                        'function'))
+    for func, (_, nc, tt, ct, _) in rows[:n]:
+        out.write('%12d %12.6f %12.6f  %s\n' % (nc, tt, ct, func_name(func)))
+
+
+def diff(old, new, sort, n, scale_old=1., scale_new=1., out=sys.stdout):
+    """
+    Functions whose sort column changed the most between old and new,
+    each side multiplied by its scale first.
+    """
+    column = SORTS[sort]
+    zero = (0, 0, 0., 0.)
+    rows = []
+    for func in set(old.stats) | set(new.stats):
+        a = old.stats.get(func, zero)[column] * scale_old
+        b = new.stats.get(func, zero)[column] * scale_new
+        rows.append((abs(b - a), a, b, func))
+    rows.sort(key=lambda row: row[0], reverse=True)
+    out.write('%12s %12s %12s %8s  %s\n' % ('old', 'new', 'delta', '%',
+                                           'function'))
+    for _, a, b, func in rows[:n]:
+        pct = '%+7.1f%%' % (100. * (b - a) / a) if a else '     new'
+        out.write('%12.6f %12.6f %+12.6f %8s  %s\n' % (
+            a, b, b - a, pct, func_name(func)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Merge pstats profiles, show the top functions or '
+                    'diff two builds.')
+    parser.add_argument('paths', nargs='+',
+                        help='.prof files or directories of them; with '
+                             '--diff, exactly two: old and new')
+    parser.add_argument('--sort', choices=sorted(SORTS), default='cumulative')
+    parser.add_argument('--top', type=int, default=30)
+    parser.add_argument('--out', help='write the merged profile here')
+    parser.add_argument('--diff', action='store_true',
+                        help='compare the first path against the second')
+    parser.add_argument('--per-profile', action='store_true',
+                        help='with --diff, compare averages per profile '
+                             'rather than totals, for runs of unequal size')
+    args = parser.parse_args(argv)
+    try:
+        run(args)
+    except (ValueError, EnvironmentError) as e:    # bad paths or profiles
+        parser.error(str(e))
+
+
+def run(args):
+
+    if args.diff:
+        if len(args.paths) != 2:
+            raise ValueError('--diff takes an old and a new path')
+        old, n_old = merge(args.paths[:1])
+        new, n_new = merge(args.paths[1:])
+        scale_old = scale_new = 1.
+        if args.per_profile:
+            scale_old, scale_new = 1. / n_old, 1. / n_new
+        sys.stdout.write('%d old profiles, %d new profiles, by %s\n' % (
+            n_old, n_new, args.sort))
+        diff(old, new, args.sort, args.top, scale_old, scale_new)
+        return
+
+    stats, count = merge(args.paths)
+    if args.out:
+        stats.dump_stats(args.out)
+    sys.stdout.write('%d profiles, %.3f seconds, by %s\n' % (
+        count, stats.total_tt, args.sort))
+    top(stats, args.sort, args.top)
+
+
+if __name__ == '__main__':
+    main()
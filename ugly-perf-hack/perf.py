@@ -1,14 +1,27 @@
 #!/usr/bin/env python
 
+import itertools
+import json
 import logging
+import math
 import os
+import signal
+import socket
 import sys
+import time
 import timeit
+import threading
 import traceback
 import cProfile
 from functools import wraps
 from contextlib import contextmanager
-from collections import Counter
+from collections import Counter, namedtuple, deque
+from logging.handlers import RotatingFileHandler
+
+try:
+    import asyncio
+except ImportError:     # Python 2
+    asyncio = None
 
 logging.basicConfig(
     format='%(asctime)-15s  %(levelname)s  %(filename)s:%(lineno)d  %(message)s',
@@ -17,21 +30,42 @@ logging.basicConfig(
 )
 
 # pylint: disable=protected-access
-def findCaller(_):
-    f = logging.currentframe()
-    for _ in range(2 + logging._frame_delta):
-        if f is not None:
-            f = f.f_back
-    rv = "(unknown file)", 0, "(unknown function)"
-    while hasattr(f, "f_code"):
+_PY2 = sys.version_info[0] == 2
+_in_logging = {}    # code object -> whether it is the logging module's own
+
+
+# _outside_logging and findCaller have a twin in
+# logging_hacks/log_frame_caller.py; change both together
+def _outside_logging(f):
+    while f is not None:
         co = f.f_code
-        filename = os.path.normcase(co.co_filename)
-        if filename == logging._srcfile:
-            f = f.f_back
-            continue
-        rv = (co.co_filename, f.f_lineno, co.co_name)
-        break
-    return rv
+        inside = _in_logging.get(co)
+        if inside is None:
+            inside = _in_logging[co] = \
+                os.path.normcase(co.co_filename) == logging._srcfile
+        if not inside:
+            break
+        f = f.f_back
+    return f
+
+
+def findCaller(_, stack_info=False, stacklevel=1):
+    f = _outside_logging(sys._getframe(2))     # above Logger._log
+    skip = logging._frame_delta + stacklevel - 1
+    while skip and f is not None:
+        f = f.f_back
+        skip -= 1
+    if f is None:
+        rv = "(unknown file)", 0, "(unknown function)"
+    else:
+        rv = (f.f_code.co_filename, f.f_lineno, f.f_code.co_name)
+    if _PY2:
+        return rv
+    sinfo = None
+    if stack_info and f is not None:
+        sinfo = 'Stack (most recent call last):\n' + \
+            ''.join(traceback.format_stack(f)).rstrip('\n')
+    return rv + (sinfo,)
 logging.Logger.findCaller = findCaller
 logging._frame_delta = 0
 
@@ -47,10 +81,145 @@ def logdelta(n):
 
 _WIDTH = 50
 
+Timing = namedtuple('Timing', ['count', 'total', 'min', 'max',
+                               'p50', 'p95', 'p99'])
+
+
+class RunningTiming(object):
+    """
+    Running count, total, min and max of a stream of durations, plus a
+    log-bucketed histogram for quantiles: every duration lands in a bucket
+    whose bounds are within `accuracy` of each other, so a quantile comes
+    out within that relative error. Memory depends on the spread of the
+    durations (a few hundred buckets from microseconds to hours), not on
+    their number, and two of them merge by adding bucket counts, so
+    timings from several profilers or processes can be combined.
+    """
+    __slots__ = ('count', 'total', 'min', 'max', 'buckets', '_log_gamma')
+
+    # anything faster than this is counted as zero
+    _TINY = 1e-9
+
+    def __init__(self, accuracy=0.01):
+        self.count = 0
+        self.total = 0.
+        self.min = float('inf')
+        self.max = 0.
+        self.buckets = {}
+        self._log_gamma = math.log((1 + accuracy) / (1 - accuracy))
+
+    def add(self, t):
+        self.count += 1
+        self.total += t
+        if t < self.min:
+            self.min = t
+        if t > self.max:
+            self.max = t
+        i = int(math.ceil(math.log(t) / self._log_gamma)) \
+            if t > self._TINY else None
+        self.buckets[i] = self.buckets.get(i, 0) + 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        for i, n in other.buckets.items():
+            self.buckets[i] = self.buckets.get(i, 0) + n
+        return self
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.buckets.get(None, 0)
+        if rank < seen:
+            return 0.
+        for i in sorted(i for i in self.buckets if i is not None):
+            seen += self.buckets[i]
+            if rank < seen:
+                # middle of the bucket, in relative terms
+                value = 2 * math.exp(i * self._log_gamma) / \
+                    (1 + math.exp(self._log_gamma))
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def timing(self):
+        return Timing(self.count, self.total, self.min, self.max,
+                      self.quantile(.5), self.quantile(.95),
+                      self.quantile(.99))
+
+
+def _current_task():
+    if asyncio is None:
+        return None
+    try:
+        return asyncio.current_task()
+    except RuntimeError:    # no event loop running in this thread
+        return None
+
+
+class _TimedCoroutine(object):
+    """
+    Wraps the coroutine of a profiled async function, so that its span
+    opens when the task first runs it and closes when it finishes, however
+    many times it gets suspended in between.
+    """
+
+    def __init__(self, hack, name, coro):
+        self._hack = hack
+        self._name = name
+        self._it = coro.__await__()
+        self._span = None
+
+    def __await__(self):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def _step(self, method, *args):
+        if self._span is None:
+            self._span = self._hack._enter(self._name)
+        try:
+            return method(*args)
+        except BaseException:
+            self._finish()
+            raise
+
+    def _finish(self):
+        # once only, GeneratorExit may come through throw() then close()
+        if self._span:
+            self._hack._exit(self._span)
+            self._span = False
+
+    def send(self, value):
+        return self._step(self._it.send, value)
+
+    def throw(self, *exc):
+        return self._step(self._it.throw, *exc)
+
+    def __next__(self):
+        return self.send(None)
+    next = __next__
+
+    def close(self):
+        try:
+            self._it.close()
+        finally:
+            self._finish()
+
+
 class ProfilerHack(object):
     """
     An ill-designed performance measuring thing for Python, use at your own risk.
     I'd prefer line_profiler except I'm on Python 2.7 and cannot upgrade.
+
+    Timed regions can nest. Each thread, and each asyncio task, has its own
+    stack of open regions, so a region's own (exclusive) time leaves out
+    what was spent in the regions nested inside it, and concurrent threads
+    or tasks don't get mixed up. After start_trace(), every region is also
+    kept as a Chrome trace event, see write_trace.
     """
     _profilers = {}
 
@@ -61,7 +230,75 @@ class ProfilerHack(object):
         return cls._profilers[name]
 
     def __init__(self):
-        self._profile_info = {}
+        self._profile_info = {}     # name -> RunningTiming, inclusive
+        self._self_time = {}        # name -> total exclusive time
+        self._stacks = {}           # (thread, task) -> open spans
+        self._lock = threading.Lock()
+        self._trace = None
+        self._names = {}            # (code, line, legend) -> pretty name
+
+    def _record(self, name, t, own):
+        with self._lock:
+            timing = self._profile_info.get(name)
+            if timing is None:
+                timing = self._profile_info[name] = RunningTiming()
+                self._self_time[name] = 0.
+            timing.add(t)
+            self._self_time[name] += own
+
+    def _enter(self, name):
+        task = _current_task()
+        thread = threading.current_thread().ident
+        if task is None:
+            key, row = (thread, None), 'thread %d' % thread
+        else:
+            # the name, not the task, so spans and traces don't keep it alive
+            key, row = (thread, id(task)), 'task %s' % (
+                task.get_name() if hasattr(task, 'get_name') else id(task))
+        # [name, start, time spent in children, stack key, trace row name]
+        span = [name, timeit.default_timer(), 0., key, row]
+        self._stacks.setdefault(key, []).append(span)
+        return span
+
+    def _exit(self, span):
+        end = timeit.default_timer()
+        name, start, children, key, row = span
+        stack = self._stacks.get(key, [])
+        if span in stack:
+            stack.remove(span)
+        if not stack:
+            self._stacks.pop(key, None)
+        duration = end - start
+        if stack:
+            stack[-1][2] += duration
+        self._record(name, duration, duration - children)
+        if self._trace is not None:
+            self._trace.append((name, start, duration, duration - children,
+                                key, row))
+
+    def start_trace(self, maxlen=100000):
+        """Start keeping the last maxlen regions for write_trace."""
+        self._trace = deque(maxlen=maxlen)
+
+    def write_trace(self, f):
+        """
+        Write the kept regions as Chrome trace-event JSON, for chrome://tracing
+        or ui.perfetto.dev. Each asyncio task gets its own row.
+        """
+        pid = os.getpid()
+        events = []
+        rows = {}
+        for name, start, duration, own, (thread, task_id), row in \
+                list(self._trace or ()):
+            tid = thread if task_id is None else task_id
+            if tid not in rows:
+                rows[tid] = row
+                events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid,
+                               'tid': tid, 'args': {'name': rows[tid]}})
+            events.append({'name': name, 'ph': 'X', 'pid': pid, 'tid': tid,
+                           'ts': start * 1e6, 'dur': duration * 1e6,
+                           'args': {'self_us': own * 1e6}})
+        json.dump({'traceEvents': events}, f)
 
     def pretty_name(self, file, line, msg):
         r = "{0}({1}) {2}".format(file, line, msg)
@@ -71,52 +308,296 @@ class ProfilerHack(object):
 
     def profile(self, f):
         name = self.pretty_name(
-            f.func_code.co_filename,
-            f.func_code.co_firstlineno,
-            f.func_code.co_name
+            f.__code__.co_filename,
+            f.__code__.co_firstlineno,
+            f.__code__.co_name
         )
 
         @wraps(f)
         def wrapper_with_debug(*args, **kwargs):
-            start = timeit.default_timer()
-            r = f(*args, **kwargs)
-            end = timeit.default_timer()
-            self._profile_info[end] = (name, end - start)
-            return r
+            span = self._enter(name)
+            try:
+                return f(*args, **kwargs)
+            finally:
+                self._exit(span)
+
+        @wraps(f)
+        def coroutine_wrapper(*args, **kwargs):
+            return _TimedCoroutine(self, name, f(*args, **kwargs))
         if logging.getLogger().isEnabledFor(logging.DEBUG):
+            if asyncio is not None and asyncio.iscoroutinefunction(f):
+                return coroutine_wrapper
             return wrapper_with_debug
         else:
             return f
 
     def get_profile(self):
-        d = {}
-        for (_, (name, t)) in self._profile_info.items():
-            if name not in d:
-                d[name] = 0.
-            d[name] += t
-        return d
+        return dict((name, timing.total)
+                    for name, timing in self._profile_info.items())
+
+    def get_timings(self):
+        """name -> Timing(count, total, min, max, p50, p95, p99), inclusive"""
+        return dict((name, timing.timing())
+                    for name, timing in self._profile_info.items())
+
+    def get_self_times(self):
+        """name -> total time not spent in nested regions"""
+        return dict(self._self_time)
+
+    def merge(self, other):
+        """Fold another ProfilerHack's timings into this one."""
+        for name, timing in other._profile_info.items():
+            if name not in self._profile_info:
+                self._profile_info[name] = RunningTiming()
+                self._self_time[name] = 0.
+            self._profile_info[name].merge(timing)
+            self._self_time[name] += other._self_time[name]
+        return self
 
     def show_profile(self):
         if logging.getLogger().isEnabledFor(logging.DEBUG):
             with logdelta(1):
-                lst = [(-t, name) for name, t in self.get_profile().items()]
+                own = self.get_self_times()
+                lst = [(-t.total, name, t)
+                       for name, t in self.get_timings().items()]
                 lst.sort()
-                for t, name in lst:
-                    fmt = "{0:>" + str(_WIDTH) + "} {1}"
-                    logging.debug(fmt.format(name, -t))
+                fmt = ("{0:>" + str(_WIDTH) + "} {1:.6f}  self={2:.6f}"
+                       "  n={3}  p50={4:.6f} p95={5:.6f} p99={6:.6f}")
+                for _, name, t in lst:
+                    logging.debug(fmt.format(name, t.total, own[name],
+                                             t.count, t.p50, t.p95, t.p99))
 
     @contextmanager
     def context(self, legend):
         if logging.getLogger().isEnabledFor(logging.DEBUG):
-            filename, line, _, _ = traceback.extract_stack()[-3]
-            name = self.pretty_name(filename, line, legend)
-            start = timeit.default_timer()
-            yield
-            end = timeit.default_timer()
-            self._profile_info[end] = (name, end - start)
+            # this generator, then contextlib's __enter__, then the caller
+            f = sys._getframe(2)
+            key = (f.f_code, f.f_lineno, legend)
+            name = self._names.get(key)
+            if name is None:
+                name = self._names[key] = self.pretty_name(
+                    f.f_code.co_filename, f.f_lineno, legend)
+            span = self._enter(name)
+            try:
+                yield
+            finally:
+                self._exit(span)
         else:
             yield
 
+class SamplingProfiler(object):
+    """
+    A statistical profiler: a background thread looks at the stack of every
+    other thread hz times a second, so the profiled code runs untouched
+    instead of paying for two timer calls per call. Samples go into a call
+    tree of at most max_nodes nodes; once it is full, samples that would
+    need a new node are counted against the deepest node they already
+    share, under a "[truncated]" child. Export is in the collapsed stack
+    format that flamegraph.pl and speedscope read.
+
+        with SamplingProfiler(hz=200) as sp:
+            outer()
+        with open('out.folded', 'w') as f:
+            sp.write_collapsed(f)
+    """
+    TRUNCATED = '[truncated]'
+
+    def __init__(self, hz=100, max_nodes=10000):
+        self.interval = 1.0 / hz
+        self.max_nodes = max_nodes
+        self._root = [0, {}]    # [self samples, {child key: node}]
+        self._nodes = 1
+        self.samples = 0
+        self._names = {}        # code object -> pretty name
+        # the sampler thread writes while others read, reentrant so
+        # that a signal landing in a reader can't deadlock
+        self._lock = threading.RLock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='SamplingProfiler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _run(self):
+        me = threading.current_thread().ident
+        while not self._stop_event.wait(self.interval):
+            with self._lock:
+                for ident, frame in sys._current_frames().items():
+                    if ident != me:
+                        self._add(frame)
+
+    def _add(self, frame):
+        stack = []
+        while frame is not None:
+            stack.append(frame.f_code)
+            frame = frame.f_back
+        node = self._root
+        for code in reversed(stack):
+            children = node[1]
+            child = children.get(code)
+            if child is None:
+                if self._nodes >= self.max_nodes:
+                    child = children.get(self.TRUNCATED)
+                    if child is None:
+                        child = children[self.TRUNCATED] = [0, {}]
+                        self._nodes += 1
+                    node = child
+                    break
+                child = children[code] = [0, {}]
+                self._nodes += 1
+            node = child
+        node[0] += 1
+        self.samples += 1
+
+    def _name(self, code):
+        if code == self.TRUNCATED:
+            return code
+        name = self._names.get(code)
+        if name is None:
+            name = '{0} ({1}:{2})'.format(code.co_name,
+                                          os.path.basename(code.co_filename),
+                                          code.co_firstlineno)
+            # the collapsed format uses ; and space as separators
+            name = self._names[code] = name.replace(';', ':')
+        return name
+
+    def collapsed(self):
+        """[("outer;middle;inner", self samples)] for every stack seen."""
+        stacks = []
+        with self._lock:
+            todo = [((), self._root)]
+            while todo:
+                path, (count, children) = todo.pop()
+                if count:
+                    stacks.append((';'.join(path), count))
+                for key, child in children.items():
+                    todo.append((path + (self._name(key),), child))
+        return stacks
+
+    def write_collapsed(self, f):
+        for stack, count in sorted(self.collapsed()):
+            f.write('{0} {1}\n'.format(stack, count))
+
+
+Window = namedtuple('Window', ['start', 'end', 'samples', 'top'])
+
+
+class ContinuousProfiler(SamplingProfiler):
+    """
+    Sampling that stays on for the life of a daemon, where profile_to_log
+    would cost too much and only report at the end. Every window seconds
+    the top functions by self samples go into a Window, kept in a ring of
+    the last keep windows and logged at log_level, to a rotating file if
+    path is given, else to the root logger. After install_signal(),
+    kill -USR2 logs the ring and the window in progress.
+
+        profiler = ContinuousProfiler(window=60, path='/var/log/app.prof')
+        profiler.install_signal()
+        profiler.start()
+    """
+
+    def __init__(self, window=60, top=20, hz=20, keep=60, path=None,
+                 max_bytes=1 << 20, backups=5, log_level=logging.INFO):
+        SamplingProfiler.__init__(self, hz=hz)
+        self.window = window
+        self.top = top
+        self.windows = deque(maxlen=keep)
+        self.log_level = log_level
+        self._reset(time.time())
+        if path is None:
+            self._logger = logging.getLogger()
+        else:
+            self._logger = logging.getLogger('perf.continuous.' + path)
+            if not self._logger.handlers:
+                handler = RotatingFileHandler(path, maxBytes=max_bytes,
+                                              backupCount=backups)
+                handler.setFormatter(logging.Formatter('%(message)s'))
+                self._logger.addHandler(handler)
+            self._logger.setLevel(log_level)
+            self._logger.propagate = False
+
+    def _reset(self, now):
+        self._start = now
+        self._samples = 0
+        self._self = Counter()      # code -> samples with it on top
+        self._total = Counter()     # code -> samples with it anywhere
+
+    def _run(self):
+        me = threading.current_thread().ident
+        while not self._stop_event.wait(self.interval):
+            now = time.time()
+            if now >= self._start + self.window:
+                self._emit(self._rotate(now))
+            with self._lock:
+                for ident, frame in sys._current_frames().items():
+                    if ident != me:
+                        self._add(frame)
+        self._emit(self._rotate(time.time()))
+
+    def _add(self, frame):
+        top = frame.f_code
+        seen = set()
+        while frame is not None:
+            seen.add(frame.f_code)
+            frame = frame.f_back
+        self._self[top] += 1
+        self._total.update(seen)
+        self._samples += 1
+        self.samples += 1
+
+    def _summary(self, now):
+        top = [(self._name(code), n, self._total[code])
+               for code, n in self._self.most_common(self.top)]
+        return Window(self._start, now, self._samples, top)
+
+    def _rotate(self, now):
+        with self._lock:
+            window = self._summary(now)
+            self.windows.append(window)
+            self._reset(now)
+        return window
+
+    def snapshot(self):
+        """The kept windows, then the one in progress."""
+        with self._lock:
+            return list(self.windows) + [self._summary(time.time())]
+
+    def _emit(self, window):
+        log = self._logger.log
+        level = self.log_level
+        log(level, 'profile %s - %s  %d samples',
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(window.start)),
+            time.strftime('%H:%M:%S', time.localtime(window.end)),
+            window.samples)
+        for name, own, total in window.top:
+            log(level, '  self %5.1f%%  total %5.1f%%  %s',
+                100. * own / window.samples, 100. * total / window.samples,
+                name)
+
+    def dump(self, *_):
+        for window in self.snapshot():
+            self._emit(window)
+
+    def install_signal(self, signum=signal.SIGUSR2):
+        """Make signum log every kept window, and the current one."""
+        signal.signal(signum, self.dump)
+
+
 if False:
     ## Let's test it
 
@@ -153,8 +634,24 @@ if False:
 
 ########################
 
+_dumps = itertools.count()
+
+
+def _dump_path(directory):
+    """A file name in directory that no other process or host will pick."""
+    return os.path.join(directory, '%s-%d-%d.prof' % (
+        socket.gethostname(), os.getpid(), next(_dumps)))
+
+
 @contextmanager
-def profile_to_log(log_level):
+def profile_to_log(log_level, dump=None):
+    """
+    Profile the with block and log the stats at log_level.
+
+    @param dump: directory to also save the stats in, in the binary pstats
+        format, so that collect_profiles.py can merge them across processes
+        and hosts
+    """
     class StreamToLogger(object):
         def __init__(self, logger):
             self.logger = logger
@@ -184,6 +681,10 @@ def profile_to_log(log_level):
             orig_ss, sys.stdout = sys.stdout, StreamToLogger(logger)
             pr.print_stats(sort='tottime')
             sys.stdout = orig_ss
+            if dump is not None:
+                if not os.path.isdir(dump):
+                    os.makedirs(dump)
+                pr.dump_stats(_dump_path(dump))
 
 ########################
 
@@ -209,5 +710,10 @@ def outer():
             c.update('ijkl')
         middle()
 
-with profile_to_log(logging.INFO):
-    outer()
+if __name__ == '__main__':
+    with profile_to_log(logging.INFO):
+        outer()
+
+    with SamplingProfiler(hz=1000) as sp:
+        outer()
+    sp.write_collapsed(sys.stdout)
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+
+import json
+import logging
+import os
+import random
+import signal
+import sys
+import threading
+import time
+
+import pytest
+from perf import (RunningTiming, ProfilerHack, SamplingProfiler,
+                  ContinuousProfiler)
+
+
+@pytest.fixture(autouse=True)
+def debug(caplog):
+    # ProfilerHack only times anything when DEBUG is on
+    caplog.set_level(logging.DEBUG)
+
+
+def named(table, legend):
+    """The value of the one entry whose pretty name ends with legend."""
+    found = [v for k, v in table.items() if k.endswith(legend)]
+    assert len(found) == 1, table
+    return found[0]
+
+
+def test_running_timing_quantiles_within_accuracy():
+    rng = random.Random(42)
+    durations = [rng.lognormvariate(-7, 2) for _ in range(10000)]
+    timing = RunningTiming(accuracy=0.01)
+    for t in durations:
+        timing.add(t)
+    durations.sort()
+    for q in (.01, .25, .5, .9, .95, .99, .999):
+        exact = durations[int(q * (len(durations) - 1))]
+        assert abs(timing.quantile(q) - exact) <= 0.01 * exact * 1.0001, q
+    assert timing.count == 10000
+    assert timing.min == durations[0]
+    assert timing.max == durations[-1]
+
+
+def test_running_timing_edges():
+    timing = RunningTiming()
+    assert timing.quantile(.5) is None
+    timing.add(0.)
+    timing.add(0.)
+    timing.add(1.)
+    assert timing.quantile(0) == 0.
+    assert abs(timing.quantile(1) - 1.) <= 0.01
+
+
+def test_running_timing_merge_is_like_one_stream():
+    rng = random.Random(1)
+    durations = [rng.expovariate(1000) for _ in range(1000)]
+    whole, first, second = RunningTiming(), RunningTiming(), RunningTiming()
+    for i, t in enumerate(durations):
+        whole.add(t)
+        (first if i % 2 else second).add(t)
+    merged = first.merge(second)
+    assert merged.buckets == whole.buckets
+    assert (merged.count, merged.min, merged.max) == \
+        (whole.count, whole.min, whole.max)
+    assert abs(merged.total - whole.total) < 1e-9
+    assert merged.timing()[4:] == whole.timing()[4:]
+
+
+def test_profiler_merge():
+    one, two = ProfilerHack(), ProfilerHack()
+
+    def work():
+        return sum(range(100))
+    on_one = one.profile(work)
+    on_two = two.profile(work)
+    for _ in range(3):
+        on_one()
+    for _ in range(5):
+        on_two()
+    self_one = named(one.get_self_times(), 'work')
+    self_two = named(two.get_self_times(), 'work')
+    one.merge(two)
+    timing = named(one.get_timings(), 'work')
+    assert timing.count == 8
+    assert timing.min <= timing.p50 <= timing.p99 <= timing.max
+    assert abs(named(one.get_self_times(), 'work') -
+               (self_one + self_two)) < 1e-9
+    # the other one is left alone
+    assert named(two.get_timings(), 'work').count == 5
+
+
+def test_nested_regions_inclusive_and_self_time():
+    p = ProfilerHack()
+    with p.context('outer'):
+        time.sleep(0.02)
+        with p.context('inner'):
+            time.sleep(0.05)
+    outer = named(p.get_timings(), 'outer').total
+    inner = named(p.get_timings(), 'inner').total
+    assert inner >= 0.05
+    assert outer >= inner + 0.02
+    # the outer region's own time leaves out the inner one
+    assert abs(named(p.get_self_times(), 'outer') - (outer - inner)) < 1e-6
+    assert named(p.get_self_times(), 'inner') == inner
+
+
+def test_threads_have_their_own_stacks():
+    p = ProfilerHack()
+    started = threading.Event()
+
+    def other():
+        with p.context('other thread'):
+            started.set()
+            time.sleep(0.05)
+    t = threading.Thread(target=other)
+    with p.context('main thread'):
+        t.start()
+        started.wait()
+        t.join()
+    main = named(p.get_timings(), 'main thread').total
+    # the other thread's region overlaps, but isn't nested in this one
+    assert named(p.get_self_times(), 'main thread') == main
+    assert named(p.get_self_times(), 'other thread') >= 0.05
+    assert p._stacks == {}
+
+
+def test_write_trace(tmpdir):
+    p = ProfilerHack()
+    p.start_trace()
+    with p.context('outer'):
+        with p.context('inner'):
+            pass
+    path = str(tmpdir.join('trace.json'))
+    with open(path, 'w') as f:
+        p.write_trace(f)
+    with open(path) as f:
+        events = json.load(f)['traceEvents']
+    meta = [e for e in events if e['ph'] == 'M']
+    spans = dict((e['name'].split()[-1], e) for e in events if e['ph'] == 'X')
+    assert len(meta) == 1
+    assert meta[0]['args']['name'] == \
+        'thread %d' % threading.current_thread().ident
+    assert sorted(spans) == ['inner', 'outer']
+    inner, outer = spans['inner'], spans['outer']
+    assert inner['tid'] == outer['tid'] == meta[0]['tid']
+    # inner sits inside outer on the same row
+    assert outer['ts'] <= inner['ts']
+    assert inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur']
+    assert abs(outer['args']['self_us'] -
+               (outer['dur'] - inner['dur'])) < 1e-3
+
+
+def functions(stack):
+    """The function names along a collapsed stack."""
+    return [name.split(' ')[0] for name in stack.split(';')]
+
+
+def test_sampling_profiler_collapsed():
+    sp = SamplingProfiler()
+
+    def inner():
+        sp._add(sys._getframe())
+
+    def outer():
+        sp._add(sys._getframe())
+        inner()
+        inner()
+    outer()
+    stacks = sorted((functions(stack)[-2:], count)
+                    for stack, count in sp.collapsed())
+    assert stacks == [(['outer', 'inner'], 2),
+                      (['test_sampling_profiler_collapsed', 'outer'], 1)]
+    assert sp.samples == 3
+
+
+def test_sampling_profiler_truncates_at_max_nodes():
+    sp = SamplingProfiler()
+
+    def inner():
+        sp._add(sys._getframe())
+
+    def outer(deeper):
+        if deeper:
+            return inner()
+        sp._add(sys._getframe())
+    outer(False)
+    sp.max_nodes = sp._nodes
+    outer(True)
+    outer(True)
+    stacks = sorted((functions(stack)[-2:], count)
+                    for stack, count in sp.collapsed())
+    # inner would need a new node, it gets counted as outer's
+    assert stacks == [(['outer', '[truncated]'], 2),
+                      (['test_sampling_profiler_truncates_at_max_nodes',
+                        'outer'], 1)]
+    assert sp._nodes == sp.max_nodes + 1
+
+
+def test_sampling_profiler_collapsed_while_sampling():
+    stop = threading.Event()
+
+    def busy(depth):
+        if depth:
+            return busy(depth - 1)
+        while not stop.wait(0.001):
+            pass
+    workers = [threading.Thread(target=busy, args=(d,)) for d in range(4)]
+    for t in workers:
+        t.start()
+    try:
+        with SamplingProfiler(hz=1000) as sp:
+            deadline = time.time() + 0.2
+            while time.time() < deadline:
+                sp.collapsed()
+    finally:
+        stop.set()
+        for t in workers:
+            t.join()
+    assert sum(count for _, count in sp.collapsed()) == sp.samples > 0
+
+
+def spin(stop):
+    while not stop.is_set():
+        pass
+
+
+@pytest.fixture
+def continuous(tmpdir):
+    """A profiler with short windows logging to a file, and a busy thread."""
+    path = str(tmpdir.join('app.prof'))
+    profiler = ContinuousProfiler(window=0.05, hz=200, path=path)
+    stop = threading.Event()
+    busy = threading.Thread(target=spin, args=(stop,))
+    busy.start()
+    try:
+        yield profiler, path
+    finally:
+        stop.set()
+        busy.join()
+        for handler in profiler._logger.handlers:
+            handler.close()
+
+
+def test_continuous_profiler_windows(continuous):
+    profiler, path = continuous
+    profiler.start()
+    time.sleep(0.3)
+    profiler.stop()
+    windows = list(profiler.windows)
+    assert len(windows) >= 3
+    for earlier, later in zip(windows, windows[1:]):
+        assert earlier.end == later.start
+    assert sum(w.samples for w in windows) == profiler.samples
+    assert any(name.startswith('spin ') for w in windows
+               for name, _, _ in w.top)
+    for w in windows:
+        for name, own, total in w.top:
+            assert 0 < own <= total <= w.samples
+    current = profiler.snapshot()
+    assert current[:-1] == windows
+    assert current[-1].start == windows[-1].end
+    assert current[-1].samples == 0
+    with open(path) as f:
+        logged = f.read()
+    assert logged.count('profile ') == len(windows)
+    assert 'spin (test_perf.py:' in logged
+
+
+def test_continuous_profiler_dump_on_signal(continuous):
+    profiler, path = continuous
+    profiler.install_signal()
+    try:
+        with profiler:
+            time.sleep(0.12)
+            with open(path) as f:
+                before = f.read().count('profile ')
+            os.kill(os.getpid(), signal.SIGUSR2)
+            time.sleep(0.01)    # the handler runs between bytecodes
+            with open(path) as f:
+                after = f.read().count('profile ')
+    finally:
+        signal.signal(signal.SIGUSR2, signal.SIG_DFL)
+    # every kept window again, and the one in progress
+    assert after >= 2 * before + 1
+    assert before >= 1
@@ -0,0 +1,58 @@
+# Python 3 only, async def is a syntax error in Python 2.
+# python3 -m pytest test_perf_async.py
+
+import asyncio
+import gc
+import io
+import json
+import logging
+import weakref
+
+import pytest
+from perf import ProfilerHack
+
+
+@pytest.fixture(autouse=True)
+def debug(caplog):
+    # ProfilerHack only times anything when DEBUG is on
+    caplog.set_level(logging.DEBUG)
+
+
+def test_closed_coroutine_closes_its_span():
+    p = ProfilerHack()
+
+    @p.profile
+    async def suspended():
+        await asyncio.sleep(0)
+    it = suspended().__await__()
+    next(it)
+    assert len(p._stacks) == 1
+    it.close()
+    assert p._stacks == {}
+    it.close()
+    # closing twice times it once
+    [timing] = p.get_timings().values()
+    assert timing.count == 1
+
+
+def test_trace_keeps_task_name_not_task():
+    p = ProfilerHack()
+    p.start_trace()
+
+    @p.profile
+    async def work():
+        await asyncio.sleep(0)
+
+    async def main():
+        task = asyncio.ensure_future(work())
+        task.set_name('worker')
+        await task
+        return weakref.ref(task)
+    task = asyncio.run(main())
+    gc.collect()
+    assert task() is None
+    f = io.StringIO()
+    p.write_trace(f)
+    [meta] = [e for e in json.loads(f.getvalue())['traceEvents']
+              if e['ph'] == 'M']
+    assert meta['args']['name'] == 'task worker'